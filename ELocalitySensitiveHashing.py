@@ -139,6 +139,12 @@ INTRODUCTION:
     of the hash functions.  And each distinct value for the index r for
     each index b shows the output of a separate hash function within each
     band.
+
+    In the code, this table is stored transposed and bit-packed: the
+    matrix self.signatures has one row of bytes per data sample, with the
+    r*b hash bits of the sample packed eight to a byte.  The r bits of a
+    band for a sample are read off as a single integer key, and the
+    samples in a band are bucketed by sorting on those integer keys.
             
     The AND-OR property says that for any two data samples to be considered
     similar they must agree with respect to all the hash values in ALL of
@@ -353,6 +359,29 @@ USAGE:
    are then pooled together and each sample in the pool assigned to the
    closest retained cluster.
 
+   If your data is already in memory as a numpy array, you can skip the
+   CSV file altogether:
+
+        lsh = LocalitySensitiveHashing.from_array( 
+                   matrix,
+                   ids = sample_names,
+                   r = 50,            
+                   b = 100,              
+                   expected_num_of_clusters = 10,
+              )
+        lsh.initialize_hash_store()
+        lsh.hash_all_data()
+
+   where 'matrix' has one row per data sample and 'dim' is taken from its
+   number of columns.
+
+   The coalescence step in the usage example can also be carried out
+   directly on the LSH buckets with a union-find forest, which joins
+   every chain of overlapping groups into a single group:
+
+        similarity_groups = lsh.lsh_basic_for_neighborhood_clusters()
+        coalesced_similarity_groups = lsh.merge_similarity_groups_with_union_find()
+
    In the usage example shown above for clustering the data, you can
    replace the call in the next to the last statement by
 
@@ -372,7 +401,8 @@ CONSTRUCTOR PARAMETERS:
                          corresponds one data point in a vector space. 
                          Each record must have associated with it a 
                          unique symbolic name that must be in the first
-                         column.
+                         column.  Not needed when the instance is 
+                         constructed with from_array().
 
     dim:                 Is set to the dimensionality of the vector space
                          in which the data is defined.
@@ -388,6 +418,40 @@ CONSTRUCTOR PARAMETERS:
     expected_num_of_clusters:  This tell the module how many clusters
                          you expect to see in your datafile.
 
+    keep_hash_store:     When set, the module also maintains the per-
+                         hyperplane 'plus' and 'minus' sets of sample
+                         names in the dictionary hash_store.  Hashing
+                         itself works off the sign-bit matrix and does
+                         not need them, so this is off by default.
+
+    max_bucket_size:     If set, the largest number of samples a band
+                         bucket may hold before oversized_bucket_strategy
+                         is applied to it.  Near-identical samples, such as
+                         retweets or bot-generated tweets, can otherwise
+                         fill a bucket with thousands of samples and make
+                         everything downstream quadratic in its size.
+                         Not set by default.
+
+    oversized_bucket_strategy:  'collapse' (the default) drops from every
+                         bucket all but one of the samples whose r*b
+                         signature bits are identical to those of another
+                         sample in an oversized bucket; such a sample then
+                         shares the neighbors of the one kept, and
+                         sample_multiplicity says how many samples each
+                         kept sample stands for.  A bucket that is still
+                         too large is then split as below.  'split'
+                         divides an oversized bucket by the buckets of its
+                         samples in the following bands until the parts
+                         are small enough, so samples that only share
+                         the bucket of the first band are no longer
+                         neighbors and the similarity groups can differ
+                         from those without a cap.  Since no band
+                         separates samples with identical signatures, it
+                         collapses, as above, the sets of more than
+                         max_bucket_size of them.  Either way,
+                         bucket_stats reports the candidate pairs that
+                         were avoided.
+
     
 @title
 METHODS:
@@ -413,40 +477,63 @@ METHODS:
          this method to evaluate the quality of the clusters produced by
          the LSH module.
 
-    (3)  get_data_from_csv()
+    (3)  get_data_from_csv( dtype, chunk_size )
 
-         This method extracts the numerical data from your CSV file.
+         This method extracts the numerical data from your CSV file.  The
+         file is read in chunks of 'chunk_size' lines (65536 by default)
+         and the numerical fields of each chunk are converted in a single
+         pass into an array of the given dtype (float64 by default; pass
+         numpy.float32 to halve the memory footprint).  The loading rate is
+         printed and kept in the instance attribute load_stats.
 
-    (4)  hash_all_data()
+    (4)  hash_all_data( signature_file )
 
          It is this method that hashes all of your data records in the CSV
          file with r * b number of hash functions, each hash function being
          a randomly oriented hyperplane passing through the origin of the
-         vector space in which the data resides.
+         vector space in which the data resides.  All the samples are
+         projected on all the hyperplane normals with a single matrix
+         product, and the resulting sign bits are packed eight to a byte
+         into a uint8 matrix with one row of ceil(r * b / 8) bytes per
+         sample.  The r bits of each band are turned into an integer key
+         per sample (see band_keys()), and the samples are bucketed by
+         those keys.  If the optional 'signature_file' is given, the
+         packed sign bits are written directly into a memory-mapped
+         signature store (see signatureStore.py) instead of being held in
+         memory.
 
     (5)  initialize_hash_store()
 
          This method must be called before the 'hash_all_data()' method.
          The initialization consists of generating the desired number of
-         hyperplane orientations randomly and associating with each
-         orientation a two-bin hash table in the form of a dictionary with
-         two <key,value> pairs in it for the keys 'plus' and 'minus', with
-         'plus' standing for the positive half-space and 'minus' for the
-         negative half-space for each hyperplane.
+         hyperplane orientations randomly and storing them as the rows of
+         a single matrix.  If the constructor parameter 'keep_hash_store'
+         is set, each orientation is also associated with a two-bin hash
+         table in the form of a dictionary with two <key,value> pairs in
+         it for the keys 'plus' and 'minus', with 'plus' standing for the
+         positive half-space and 'minus' for the negative half-space for
+         each hyperplane.
 
     (6)  lsh_basic_for_nearest_neighbors()
 
          This method is this module's implementation of the hyperplane
          based LSH algorithm.  This method's mandate is what is
          traditionally accomplished with LSH --- finding nearest neighbors
-         for data elements.
+         for data elements.  Its interactive session is ended with Ctrl-C,
+         for which it installs a SIGINT handler that kills the process;
+         importing the module leaves the signal handlers alone.
 
     (7)  lsh_basic_for_neighborhood_clusters()
 
          This method is a slight variation on the previous method, in that,
          instead of returning the nearest neighbors of a data element, it
          merges the data element with its LSH-discovered neighbors to form
-         a cluster.  The method returns a list of such clusters.
+         a cluster.  The method returns a sequence of such clusters, each a
+         set of the integer ids that get_data_from_csv() assigns to the
+         samples in the order of the CSV file.  All the merging methods
+         below work with and return such sets of ids.  The sequence reads
+         its sets from the sparse matrix of the method (24) below when
+         they are asked for.
 
     (8)  merge_similarity_groups_with_coalescence()
 
@@ -479,7 +566,9 @@ METHODS:
          the difference in the mean vectors between a given excess cluster
          and each of the retained clusters. An excess cluster is merged
          with the nearest retained cluster on the basis of this difference
-         in the means of the two being the smallest.
+         in the means of the two being the smallest.  The pools of excess
+         clusters and the merged clusters are printed only when 'debug'
+         is set.
 
     (11) prune_similarity_groups(self):
 
@@ -501,6 +590,84 @@ METHODS:
          clusters returned by any of the methods in items (8), (9), and
          (10) above, and the second for the name of the disk file.
 
+    (14) band_keys( band_index )
+
+         Returns one integer key per data sample for the r hash bits of
+         the given band.  Two samples land in the same bucket of a band
+         if and only if their keys for that band are equal.
+
+    (15) build_hash_store_view()
+
+         Fills the 'plus' and 'minus' sets of sample names in hash_store
+         from the sign bits computed by hash_all_data().  This is done
+         automatically when the constructor parameter 'keep_hash_store'
+         is set.
+
+    (16) unpacked_signature_bits( start, stop )
+
+         Returns the hash bits in the range [start, stop) for all the data
+         samples as a boolean matrix with one row per sample.  Without
+         arguments, all r * b bits are returned.
+
+    (17) merge_similarity_groups_with_union_find()
+
+         Coalesces the LSH buckets into the connected components of a
+         disjoint-set forest in which the samples of every bucket are
+         unioned.  Unlike merge_similarity_groups_with_coalescence(), which
+         makes a single greedy pass, it joins every chain of overlapping
+         groups into one group.  Call it after
+         lsh_basic_for_neighborhood_clusters().
+
+    (18) groups_by_sample_name( similarity_groups )
+
+         Maps a list of similarity groups of integer sample ids to the
+         corresponding list of sets of the symbolic sample names in your
+         datafile.
+
+    (19) from_array( matrix, ids, ... )
+
+         A class method that constructs an LSH instance directly from an
+         in-memory (samples x dim) array, with 'ids' for the symbolic
+         names of its rows and optional 'weights' for the number of
+         samples each row stands for.  The remaining keyword arguments are those of
+         the constructor.  No CSV file is written or parsed.
+
+    (20) load_data_from_array( matrix, ids )
+
+         Loads an in-memory array into an existing instance.  This is what
+         get_data_from_csv() calls after parsing the datafile.
+
+    (21) from_signature_store( filename, ids, ... )
+
+         Like from_array(), but for MinHash signatures saved in a binary
+         signature store.  The store is opened with numpy.memmap, so the
+         signatures are read from disk as they are hashed.
+
+    (22) save_hyperplane_signatures( filename )
+
+         Saves the packed hyperplane sign bits to a signature store so
+         that banding and clustering can be re-run without re-hashing.
+
+    (23) load_hyperplane_signatures( filename )
+
+         Memory-maps a store written by the previous method, or by
+         hash_all_data() with a signature_file, in place of hashing.
+
+    (24) lsh_basic_for_neighborhood_adjacency()
+
+         Returns the LSH neighborhoods as a sparse samples x samples CSR
+         matrix that is True for every two samples sharing a bucket in
+         some band.  The candidate pairs of all the buckets are sorted and
+         deduplicated with numpy, so a large bucket costs one array of
+         pairs rather than a Python set per member.
+
+    (25) group_weight( group )
+
+         The size of a similarity group, with every sample counted as
+         many times as its weight when the data was loaded with weights
+         by from_array() or load_data_from_array().  The l2 norm merging
+         methods retain the heaviest groups and use weighted means.
+
 @title
 The DataGenerator CLASS:
 
@@ -663,12 +830,14 @@ ABOUT THE AUTHOR:
 '''
 
 
+import itertools
 import numpy
 import random
 import re
 import string
 import sys,os,signal
-from BitVector import *
+import time
+from signatureStore import create_signature_store, open_signature_store, write_signature_store
 
 #-----------------------------------  Utility Functions  ------------------------------------
 
@@ -712,8 +881,12 @@ def band_hash_group_index(block_name):
          "block3 10110"
 
     This function returns the block index, which is the integer that follows the 
-    word "block" in the first substring in the string that you see above.
+    word "block" in the first substring in the string that you see above.  The keys
+    of self.band_hash are (band_index, integer_key) tuples, for which the band index
+    is returned directly.
     '''
+    if isinstance(block_name, tuple):
+        return block_name[0]
     firstitem = block_name.split()[0]
     m = re.search(r'(\d+)$', firstitem)
     return int(m.group(1))
@@ -737,6 +910,19 @@ def convert(value):
 def l2norm(list1, list2):
     return numpy.linalg.norm(numpy.array(list1) - numpy.array(list2))
 
+def closest_mean_indices(vectors, means, block_size=2**22):
+    '''
+    Returns, for each row of vectors, the index of the row of means closest to it in the l2 norm,
+    the first of them in case of a tie.  The differences are formed for a block of rows at a
+    time so that at most about block_size of them are held in memory.
+    '''
+    closest = numpy.zeros(len(vectors), dtype=numpy.intp)
+    step = max(1, block_size // max(1, means.size))
+    for start in range(0, len(vectors), step):
+        differences = numpy.asarray(vectors[start:start+step], dtype=numpy.float64)[:,None,:] - means[None,:,:]
+        closest[start:start+step] = numpy.einsum('ijk,ijk->ij', differences, differences).argmin(axis=1)
+    return closest
+
 def cleanup_csv(line):
     line = line.translate(bytes.maketrans(b":?/()[]{}'",b"          ")) \
            if sys.version_info[0] == 3 else line.translate(string.maketrans(":?/()[]{}'","          "))
@@ -762,9 +948,118 @@ def cleanup_csv(line):
     line = ','.join(newfields)
     return line
 
-# Needed for cleanly terminating the interactive method lsh_basic_for_nearest_neighbors():
+class DisjointSet(object):
+    '''
+    Union-find over the integers 0 through n-1, with union by size and path compression
+    (by halving) in find().  Used for coalescing the buckets of self.band_hash.
+    '''
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return root_i
+        if self.size[root_i] < self.size[root_j]:
+            root_i, root_j = root_j, root_i
+        self.parent[root_j] = root_i
+        self.size[root_i] += self.size[root_j]
+        return root_i
+
+    def groups(self):
+        '''
+        Returns the members of each disjoint set as a list, the sets being ordered by their
+        smallest member.
+        '''
+        members = {}
+        for i in range(len(self.parent)):
+            members.setdefault(self.find(i), []).append(i)
+        return list(members.values())
+
+def bucket_pair_keys(buckets, how_many_samples):
+    '''
+    Returns the int64 keys i * how_many_samples + j of all the ordered pairs (i, j), i != j, of
+    samples that share a bucket, each bucket being an int64 array of distinct sample ids.  Each
+    member of a bucket is repeated once per member of its bucket to form the rows, and the
+    bucket is tiled as many times to form the columns.
+    '''
+    sizes = numpy.array([len(bucket) for bucket in buckets], dtype=numpy.int64)
+    members = numpy.concatenate(buckets)
+    row_sizes = numpy.repeat(sizes, sizes)                    # size of the bucket of each member
+    row_starts = numpy.repeat(numpy.cumsum(sizes) - sizes, sizes)
+    rows = numpy.repeat(members, row_sizes)
+    row_offsets = numpy.cumsum(row_sizes) - row_sizes
+    columns = members[numpy.arange(len(rows)) - numpy.repeat(row_offsets - row_starts, row_sizes)]
+    distinct = rows != columns
+    return rows[distinct] * how_many_samples + columns[distinct]
+
+def sorted_unique(keys):
+    '''
+    The distinct values of an integer array in increasing order.  The array is sorted in place
+    and the repeats are dropped, which is faster for large int64 arrays than numpy.unique().
+    '''
+    keys.sort()
+    if len(keys) == 0:
+        return keys
+    distinct = numpy.empty(len(keys), dtype=bool)
+    distinct[0] = True
+    numpy.not_equal(keys[1:], keys[:-1], out=distinct[1:])
+    return keys[distinct]
+
+class NeighborhoodGroups(object):
+    '''
+    The similarity groups of lsh_basic_for_neighborhood_clusters() as a read-only sequence over
+    the CSR adjacency of the similarity neighborhoods.  Group i is the set of sample i and its
+    neighbors; it is built from row i of the adjacency only when it is asked for.  A sample that
+    was collapsed into another one, according to representative_of, shares that sample's
+    neighbors.
+    '''
+    def __init__(self, adjacency, representative_of=None):
+        self.adjacency = adjacency
+        self.representative_of = representative_of
+
+    def __len__(self):
+        return self.adjacency.shape[0]
+
+    def __getitem__(self, sample_id):
+        if isinstance(sample_id, slice):
+            return [self[i] for i in range(*sample_id.indices(len(self)))]
+        if sample_id < 0:
+            sample_id += len(self)
+        if not 0 <= sample_id < len(self):
+            raise IndexError("similarity group index out of range")
+        row = sample_id if self.representative_of is None else int(self.representative_of[sample_id])
+        indptr = self.adjacency.indptr
+        group = set(self.adjacency.indices[indptr[row]:indptr[row+1]].tolist())
+        group.add(row)
+        group.add(sample_id)
+        return group
+
+    def __iter__(self):
+        for sample_id in range(len(self)):
+            yield self[sample_id]
+
+# Quotes, whitespace and the characters that cleanup_csv() blanks out
+csv_cleanup_chars = re.compile(r'''["':?/()\[\]{}\s]''')
+
+def needs_csv_cleanup(line):
+    '''
+    Tells whether cleanup_csv() would change anything in a line that has already been
+    stripped of its trailing whitespace.
+    '''
+    return csv_cleanup_chars.search(line) is not None or ',,' in line or line.endswith(',')
+
+# Needed for cleanly terminating the interactive method lsh_basic_for_nearest_neighbors(),
+# which installs it when its prompt loop starts rather than when the module is imported:
 def Ctrl_c_handler( signum, frame ): os.kill(os.getpid(),signal.SIGKILL)
-signal.signal(signal.SIGINT, Ctrl_c_handler)
 
 #----------------------------------- LSH Class Definition ------------------------------------
 
@@ -774,15 +1069,17 @@ class LocalitySensitiveHashing(object):
             raise Exception(  
                    '''LocalitySensitiveHashing constructor can only be called with keyword arguments for the 
                       following keywords: datafile,csv_cleanup_needed,how_many_hashes,r,b,
-                      similarity_group_min_size_threshold,debug,
-                      similarity_group_merging_dist_threshold,expected_num_of_clusters''') 
-        allowed_keys = 'datafile','dim','csv_cleanup_needed','how_many_hashes','r','b','similarity_group_min_size_threshold','similarity_group_merging_dist_threshold','expected_num_of_clusters','debug'
+                      similarity_group_min_size_threshold,debug,keep_hash_store,
+                      similarity_group_merging_dist_threshold,expected_num_of_clusters,
+                      max_bucket_size,oversized_bucket_strategy''') 
+        allowed_keys = 'datafile','dim','csv_cleanup_needed','how_many_hashes','r','b','similarity_group_min_size_threshold','similarity_group_merging_dist_threshold','expected_num_of_clusters','keep_hash_store','max_bucket_size','oversized_bucket_strategy','debug'
         keywords_used = kwargs.keys()
         for keyword in keywords_used:
             if keyword not in allowed_keys:
                 raise SyntaxError(keyword + ":  Wrong keyword used --- check spelling") 
         datafile=dim=debug=csv_cleanup_needed=how_many_hashes=r=b=similarity_group_min_size_threshold=None
-        similarity_group_merging_dist_threshold=expected_num_of_clusters=None
+        similarity_group_merging_dist_threshold=expected_num_of_clusters=keep_hash_store=max_bucket_size=None
+        oversized_bucket_strategy='collapse'
         if kwargs and not args:
             if 'csv_cleanup_needed' in kwargs : csv_cleanup_needed = kwargs.pop('csv_cleanup_needed')
             if 'datafile' in kwargs : datafile = kwargs.pop('datafile')
@@ -795,11 +1092,12 @@ class LocalitySensitiveHashing(object):
                 similarity_group_merging_dist_threshold = kwargs.pop('similarity_group_merging_dist_threshold')
             if 'expected_num_of_clusters' in kwargs  :  
                 expected_num_of_clusters = kwargs.pop('expected_num_of_clusters')
+            if 'keep_hash_store' in kwargs  :  keep_hash_store = kwargs.pop('keep_hash_store')
+            if 'max_bucket_size' in kwargs  :  max_bucket_size = kwargs.pop('max_bucket_size')
+            if 'oversized_bucket_strategy' in kwargs  :  
+                oversized_bucket_strategy = kwargs.pop('oversized_bucket_strategy')
             if 'debug' in kwargs  :  debug = kwargs.pop('debug')
-        if datafile:
-            self.datafile = datafile
-        else:
-            raise Exception("You must supply a datafile")
+        self.datafile = datafile
         self._csv_cleanup_needed = csv_cleanup_needed
         self.similarity_group_min_size_threshold = similarity_group_min_size_threshold
         self.similarity_group_merging_dist_threshold = similarity_group_merging_dist_threshold
@@ -812,15 +1110,28 @@ class LocalitySensitiveHashing(object):
         self.b = b                               # Number of bands.
         self.how_many_hashes =  r * b
         self._debug = debug
-        self._data_dict = {}                     # sample_name =>  vector_of_floats extracted from CSV stored here
+        self._keep_hash_store = keep_hash_store
+        if oversized_bucket_strategy not in ('collapse', 'split'):
+            raise Exception("'oversized_bucket_strategy' must be 'collapse' or 'split'")
+        self.max_bucket_size = max_bucket_size
+        self.oversized_bucket_strategy = oversized_bucket_strategy
+        self._data_matrix = None                 # (samples x dim) array, row sample_id holds that sample's vector
+        self._sample_names = []                  # sample_id =>  sample_name, ids assigned in the order of the CSV
+        self._sample_ids = {}                    # sample_name =>  sample_id
+        self.sample_weights = None               # sample_id =>  number of samples it counts as (None: all 1)
         self.how_many_data_samples = 0
-        self.hash_store = {}                     # hyperplane =>  {'plus' => set(), 'minus'=> set()}
-        self.htable_rows  = {}
-        self.index_to_hplane_mapping = {}
-        self.band_hash = {}                      # BitVector column =>  bucket for samples  (for the AND action)
+        self.load_stats = {}                     # throughput of the last get_data_from_csv()
+        self.hyperplanes = None                  # (how_many_hashes x dim) matrix, one unit normal per row
+        self.signatures = None                   # (samples x ceil(how_many_hashes/8)) packed hyperplane sign bits
+        self.hash_store = {}                     # hyperplane =>  {'plus' => set(), 'minus'=> set()}  (optional view)
+        self.band_hash = {}                      # (band_index, band_key) =>  bucket for samples  (for the AND action)
         self.band_hash_mean_values = {}          # Store the mean of the bucket contents in band_hash dictionary
         self.similarity_group_mean_values = {}
         self.coalesced_band_hash = {}            # Coalesce those keys of self.band_hash that have data samples in common
+        self.similarity_neighborhoods = None     # (samples x samples) CSR adjacency of the samples that share a bucket
+        self.representative_of = None            # sample_id =>  id of the sample it was collapsed into (itself if none)
+        self.sample_multiplicity = None          # sample_id =>  number of samples it stands for (0 if collapsed)
+        self.bucket_stats = {}                   # sizes and candidate pairs of the buckets of the last banding
         self.similarity_groups = []
         self.coalescence_merged_similarity_groups = []  # Is a list of sets
         self.l2norm_merged_similarity_groups = []  # Is a list of sets
@@ -828,101 +1139,384 @@ class LocalitySensitiveHashing(object):
         self.pruned_similarity_groups = []
         self.evaluation_classes = {}             # Used for evaluation of clustering quality if data in particular format
 
-    def get_data_from_csv(self):
+    @classmethod
+    def from_array(cls, matrix, ids=None, weights=None, **kwargs):
+        '''
+        Constructs an instance for data that is already in memory.  The argument matrix is a
+        (samples x dim) array, ids, if supplied, the symbolic names of its rows, and weights, if
+        supplied, the number of original samples each row stands for.  The keyword arguments are
+        the same as for the constructor, except that 'datafile' is not needed and 'dim' defaults
+        to the number of columns of matrix.
+        '''
+        matrix = numpy.asarray(matrix)
+        kwargs.setdefault('dim', matrix.shape[1])
+        lsh = cls(**kwargs)
+        lsh.load_data_from_array(matrix, ids, weights)
+        return lsh
+
+    @classmethod
+    def from_signature_store(cls, filename, ids=None, **kwargs):
+        '''
+        Constructs an instance over a MinHash signature store written with signatureStore.  The
+        store is memory-mapped read-only, so the signatures are paged in from disk as they are
+        hashed instead of being loaded up front.
+        '''
+        header, matrix = open_signature_store(filename)
+        if header['kind'] != 'minhash':
+            raise Exception("%s holds '%s' signatures, not MinHash signatures" % (filename, header['kind']))
+        return cls.from_array(matrix, ids, **kwargs)
+
+    def load_data_from_array(self, matrix, ids=None, weights=None):
+        '''
+        Row j of matrix becomes the sample with the integer id j.  All the similarity groups are
+        sets of these ids; the symbolic names in ids are only looked up for display and for
+        writing out the clusters.  The matrix is used as is, without a copy, if it is already a
+        numpy array.  If weights are given, sample j counts as weights[j] samples, e.g. the copies
+        of a duplicated tweet, in the sizes and means of the similarity groups.
+        '''
+        matrix = numpy.asarray(matrix)
+        if matrix.ndim != 2 or matrix.shape[1] != self.dim:
+            raise Exception("The data must be a 2D array with 'dim' = %d columns" % self.dim)
+        sample_names = list(ids) if ids is not None else [str(j) for j in range(len(matrix))]
+        if len(sample_names) != len(matrix):
+            raise Exception("The number of ids does not match the number of rows in the data")
+        if weights is not None:
+            weights = numpy.asarray(weights, dtype=numpy.int64)
+            if weights.shape != (len(matrix),):
+                raise Exception("The number of weights does not match the number of rows in the data")
+        self._data_matrix = matrix
+        self._sample_names = sample_names
+        self._sample_ids = {sample_name : j for (j,sample_name) in enumerate(sample_names)}
+        self.sample_weights = weights
+        self.how_many_data_samples = len(sample_names)
+
+    def get_data_from_csv(self, dtype=numpy.float64, chunk_size=65536):
+        '''
+        Each sample is given an integer id, in the order in which the samples appear in the CSV
+        file.  The file is read chunk_size lines at a time.  For each chunk, the names in the first
+        column are split off and all the numeric fields are parsed by a single numpy.fromstring()
+        call into a (lines x dim) array of the given dtype.  When 'csv_cleanup_needed' is set,
+        cleanup_csv() is only run on the lines that contain something for it to clean up.  The
+        parsed data is handed over to load_data_from_array() and the loading throughput is kept in
+        self.load_stats, and printed in debug mode.
+        '''
+        if self.datafile is None:
+            raise Exception("You must supply a datafile")
         if not self.datafile.endswith('.csv'): 
             Exception("Aborted. get_training_data_from_csv() is only for CSV files")
-        data_dict = {}
+        start_time = time.time()
+        blocks, sample_names = [], []
         with open(self.datafile) as f:
-            for i,line in enumerate(f):
-                if line.startswith("#"): continue      
-                record = cleanup_csv(line) if self._csv_cleanup_needed else line
-                parts = record.rstrip().split(r',')
-                data_dict[parts[0].strip('"')] = list(map(lambda x: convert(x), parts[1:]))
-                if i%10000 == 0:
-                    print('.'),
-                    sys.stdout.flush()
-                sys.stdout = sys.__stdout__
-            f.close() 
-        self.how_many_data_samples = i + 1
-        self._data_dict = data_dict
+            while True:
+                lines = list(itertools.islice(f, chunk_size))
+                if not lines:
+                    break
+                names, values = self._parse_csv_lines(lines, dtype)
+                sample_names.extend(names)
+                blocks.append(values)
+        data = numpy.concatenate(blocks) if blocks else numpy.empty((0, self.dim), dtype=dtype)
+        if len(set(sample_names)) != len(sample_names):
+            # A name that appears again keeps its first position but takes the values of its last record
+            last_row = {sample_name : j for (j,sample_name) in enumerate(sample_names)}
+            sample_names = list(dict.fromkeys(sample_names))
+            data = data[[last_row[sample_name] for sample_name in sample_names]]
+        self.load_data_from_array(data, sample_names)
+        elapsed = max(time.time() - start_time, 1e-9)
+        megabytes = os.path.getsize(self.datafile) / 2.0**20
+        self.load_stats = {'samples' : len(sample_names), 'seconds' : elapsed, 'megabytes' : megabytes,
+                           'samples_per_second' : len(sample_names) / elapsed,
+                           'megabytes_per_second' : megabytes / elapsed}
+        if self._debug:
+            print( "Loaded %d samples (%.1f MB) from %s in %.3f sec: %.0f samples/sec, %.1f MB/sec" % 
+                   (len(sample_names), megabytes, self.datafile, elapsed, 
+                    self.load_stats['samples_per_second'], self.load_stats['megabytes_per_second']) )
+
+    def _parse_csv_lines(self, lines, dtype):
+        names, fields = [], []
+        for line in lines:
+            if line.startswith("#"): continue
+            line = line.rstrip()
+            if not line: continue
+            if self._csv_cleanup_needed and needs_csv_cleanup(line):
+                line = cleanup_csv(line)
+            sample_name, _, rest = line.partition(',')
+            names.append(sample_name.strip('"'))
+            fields.append(rest)
+        try:
+            values = numpy.fromstring(','.join(fields), dtype=dtype, sep=',')
+        except ValueError:
+            values = None                        # a field that is not a number
+        if values is None or values.size != len(names) * self.dim:
+            raise Exception("Every record in %s must have a name followed by 'dim' = %d numeric values" % 
+                            (self.datafile, self.dim))
+        return names, values.reshape(len(names), self.dim)
+
+    def groups_by_sample_name(self, similarity_groups):
+        '''
+        Maps a list of similarity groups, each a set of integer sample ids, to the corresponding
+        list of sets of symbolic sample names.
+        '''
+        return [set(self._sample_names[sample_id] for sample_id in group) for group in similarity_groups]
 
     def show_data_for_lsh(self):
         print("\n\nData Samples:\n\n")
-        for item in sorted(self._data_dict.items(), key = lambda x: sample_index(x[0]) ):
-            print(item)
+        for (sample_id, sample_name) in enumerate(self._sample_names):
+            print( (sample_name, self._data_matrix[sample_id].tolist()) )
 
     def initialize_hash_store(self):
-        for x in range(self.how_many_hashes):
-            hplane = numpy.random.uniform(low=-1.0, high=1.0, size=self.dim)
-            hplane = hplane / numpy.linalg.norm(hplane)
-            self.hash_store[str(hplane)] = {'plus' : set(), 'minus' : set()}
+        '''
+        All r * b hyperplane orientations are drawn in one go and stored as the rows of the
+        matrix self.hyperplanes.  The two-bin dictionaries in self.hash_store are only created
+        when the constructor parameter 'keep_hash_store' is set.
+        '''
+        hplanes = numpy.random.uniform(low=-1.0, high=1.0, size=(self.how_many_hashes, self.dim))
+        self.hyperplanes = hplanes / numpy.linalg.norm(hplanes, axis=1)[:, numpy.newaxis]
+        if self._keep_hash_store:
+            self.hash_store = {str(hplane) : {'plus' : set(), 'minus' : set()} for hplane in self.hyperplanes}
 
     def hash_all_data_with_one_hyperplane(self):
         hyperplane = numpy.random.uniform(low=-1.0, high=1.0, size=self.dim)
         print( "hyperplane: %s" % str(hyperplane) )
         hyperplane = hyperplane / numpy.linalg.norm(hyperplane)
-        for sample in self._data_dict:
-            bin_val = numpy.dot( hyperplane, self._data_dict[sample])
+        for sample in range(len(self._sample_names)):
+            bin_val = numpy.dot( hyperplane, self._data_matrix[sample])
             bin_val = 1 if bin_val>= 0 else -1      
-            print( "%s: %s" % (sample, str(bin_val)) )
+            print( "%s: %s" % (self._sample_names[sample], str(bin_val)) )
 
-    def hash_all_data(self):
-        for hplane in self.hash_store:
-            for sample in self._data_dict:
-                hplane_vals = hplane.translate(bytes.maketrans(b"][", b"  ")) \
-                       if sys.version_info[0] == 3 else hplane.translate(string.maketrans("][","  "))
-                bin_val = numpy.dot(list(map(convert, hplane_vals.split())), self._data_dict[sample])
-                bin_val = 1 if bin_val>= 0 else -1      
-                if bin_val>= 0:
-                    self.hash_store[hplane]['plus'].add(sample)
+    def hash_all_data(self, signature_file=None):
+        '''
+        Projects all the data samples on all the hyperplane normals with one matrix product per
+        block of samples.  Row j of the resulting uint8 matrix self.signatures holds the sign bits
+        of the sample with id j, packed eight hyperplanes to a byte.  If signature_file is given,
+        the packed bits are written straight into a memory-mapped signature store of that name
+        instead of being kept in memory.
+        '''
+        data_matrix = self._data_matrix
+        shape = (len(data_matrix), (self.how_many_hashes + 7) // 8)
+        if signature_file is not None:
+            self.signatures = create_signature_store(signature_file, shape, numpy.uint8, kind='hplane',
+                                                     num_bits=self.how_many_hashes)
+        else:
+            self.signatures = numpy.empty(shape, dtype=numpy.uint8)
+        block_size = max(1, 2**22 // self.how_many_hashes)
+        for start in range(0, len(data_matrix), block_size):
+            projections = numpy.dot(data_matrix[start : start + block_size], self.hyperplanes.T)
+            self.signatures[start : start + block_size] = numpy.packbits(projections >= 0, axis=1)
+        if signature_file is not None:
+            self.signatures.flush()
+        if self._keep_hash_store:
+            self.build_hash_store_view()
+
+    def save_hyperplane_signatures(self, filename):
+        '''
+        Writes the packed hyperplane sign bits computed by hash_all_data() to a signature store.
+        '''
+        write_signature_store(filename, self.signatures, kind='hplane', num_bits=self.how_many_hashes)
+
+    def load_hyperplane_signatures(self, filename):
+        '''
+        Memory-maps the packed hyperplane sign bits saved by save_hyperplane_signatures(), or by
+        hash_all_data() with a signature_file, in place of calling hash_all_data().  The number of
+        bits in the store must equal r * b.
+        '''
+        header, signatures = open_signature_store(filename)
+        if header['kind'] != 'hplane' or header['num_bits'] != self.how_many_hashes:
+            raise Exception("%s does not hold r * b = %d hyperplane bits per sample" % 
+                            (filename, self.how_many_hashes))
+        if self._data_matrix is not None and len(self._data_matrix) != len(signatures):
+            raise Exception("%s holds signatures for %d samples, but %d samples are loaded" % 
+                            (filename, len(signatures), len(self._data_matrix)))
+        if not self._sample_names:
+            self._sample_names = [str(j) for j in range(len(signatures))]
+            self._sample_ids = {sample_name : j for (j,sample_name) in enumerate(self._sample_names)}
+            self.how_many_data_samples = len(signatures)
+        self.signatures = signatures
+
+    def build_hash_store_view(self):
+        '''
+        Fills self.hash_store with the 'plus' and 'minus' sets of sample names for each
+        hyperplane from the sign bits computed by hash_all_data().
+        '''
+        names = numpy.array(self._sample_names, dtype=object)
+        bits = self.unpacked_signature_bits()
+        for (i,hplane) in enumerate(self.hyperplanes):
+            self.hash_store[str(hplane)] = {'plus' : set(names[bits[:,i]]), 'minus' : set(names[~bits[:,i]])}
+
+    def unpacked_signature_bits(self, start=0, stop=None):
+        '''
+        Returns the hash bits start through stop-1 of every sample as a (samples x bits) bool matrix.
+        Only the bytes of self.signatures that cover the requested bits are unpacked.
+        '''
+        stop = self.how_many_hashes if stop is None else stop
+        bytes_needed = self.signatures[:, start // 8 : (stop + 7) // 8]
+        offset = start % 8
+        return numpy.unpackbits(bytes_needed, axis=1)[:, offset : offset + stop - start].astype(bool)
+
+    def band_keys(self, band_index):
+        '''
+        Returns one key per sample for the r bits of the given band.  When r is at most 64, the
+        keys are a uint64 vector; otherwise they are the rows of a (samples x ceil(r/64)) uint64
+        matrix.
+        '''
+        band_bits = self.unpacked_signature_bits(band_index * self.r, (band_index + 1) * self.r)
+        packed = numpy.packbits(band_bits, axis=1)
+        words = (packed.shape[1] + 7) // 8
+        padded = numpy.zeros((packed.shape[0], 8 * words), dtype=numpy.uint8)
+        padded[:, :packed.shape[1]] = packed
+        keys = padded.view('>u8').astype(numpy.uint64)
+        return keys[:,0] if words == 1 else keys
+
+    def _band_buckets(self, band_index):
+        '''
+        Returns the buckets of one band as a list of (band_key, array of sample ids) pairs, found by
+        sorting on the integer band keys, together with the bucket index of every sample.
+        '''
+        keys = self.band_keys(band_index)
+        unique_keys, bucket_of_sample = numpy.unique(keys, axis=0, return_inverse=True)
+        bucket_of_sample = bucket_of_sample.ravel()
+        order = numpy.argsort(bucket_of_sample, kind='stable')
+        boundaries = numpy.cumsum(numpy.bincount(bucket_of_sample, minlength=len(unique_keys)))[:-1]
+        buckets = []
+        for (key, members) in zip(unique_keys, numpy.split(order, boundaries)):
+            band_key = int(key) if keys.ndim == 1 else tuple(map(int, key))
+            buckets.append((band_key, members))
+        return buckets, bucket_of_sample
+
+    def _collapse_duplicates(self, oversized_buckets, min_duplicates=2):
+        '''
+        Samples whose r * b signature bits are all equal fall into the same bucket in every band.
+        For every such set of at least min_duplicates duplicates that has a member in one of the
+        oversized buckets, all but the smallest sample id are dropped from the buckets of every
+        band, and are recorded in self.representative_of as collapsed into that smallest id.
+        Returns the boolean mask of the collapsed samples.
+        '''
+        how_many_samples = len(self._sample_names)
+        sample_ids = numpy.arange(how_many_samples)
+        _, duplicate_class = numpy.unique(numpy.asarray(self.signatures), axis=0, return_inverse=True)
+        duplicate_class = duplicate_class.ravel()
+        how_many_classes = duplicate_class.max() + 1
+        representative_of_class = numpy.full(how_many_classes, how_many_samples)
+        numpy.minimum.at(representative_of_class, duplicate_class, sample_ids)
+        collapse_class = numpy.zeros(how_many_classes, dtype=bool)
+        collapse_class[duplicate_class[numpy.concatenate(oversized_buckets)]] = True
+        collapse_class &= numpy.bincount(duplicate_class, minlength=how_many_classes) >= min_duplicates
+        self.representative_of = numpy.where(collapse_class[duplicate_class],
+                                             representative_of_class[duplicate_class], sample_ids)
+        self.sample_multiplicity = numpy.bincount(self.representative_of, weights=self.sample_weights,
+                                                  minlength=how_many_samples).astype(numpy.int64)
+        return self.representative_of != sample_ids
+
+    def _split_bucket(self, band_index, members, bucket_of_sample_by_band):
+        '''
+        Sub-buckets an oversized bucket by the buckets its samples fall into in the following
+        bands, one extra band at a time, until no part has more than max_bucket_size samples or
+        the bands run out.  Returns a list of (key suffix, array of sample ids) pairs, the suffix
+        being the (band index, bucket index) pairs of the extra bands that separated the part.
+        '''
+        parts = [((), members)]
+        for extra in range(1, self.b):
+            if all(len(part) <= self.max_bucket_size for (_, part) in parts):
+                break
+            other_band = (band_index + extra) % self.b
+            if other_band not in bucket_of_sample_by_band:
+                bucket_of_sample_by_band[other_band] = self._band_buckets(other_band)[1]
+            bucket_of_sample = bucket_of_sample_by_band[other_band]
+            next_parts = []
+            for (suffix, part) in parts:
+                if len(part) <= self.max_bucket_size:
+                    next_parts.append((suffix, part))
+                    continue
+                sub_buckets = bucket_of_sample[part]
+                order = numpy.argsort(sub_buckets, kind='stable')
+                boundaries = numpy.flatnonzero(numpy.diff(sub_buckets[order])) + 1
+                for sub_part in numpy.split(part[order], boundaries):
+                    next_parts.append((suffix + ((other_band, int(bucket_of_sample[sub_part[0]])),), sub_part))
+            parts = next_parts
+        return parts
+
+    def _band_hash_all_data(self):
+        '''
+        Buckets the samples of every band by sorting on the integer band keys.  Each bucket is
+        stored in self.band_hash under the key (band_index, band_key) as a set of sample ids.
+        When max_bucket_size is set, the buckets with more samples than that are either thinned
+        out by collapsing duplicate samples ('collapse', which splits what is still too large) or
+        sub-bucketed by the following bands ('split'), and self.bucket_stats records the candidate
+        pairs that this avoided.  No band can tell apart samples with identical signatures, so
+        'split' collapses those of which there are more than max_bucket_size.  The collapsed
+        samples are left out of every bucket, whatever its size, so the buckets only depend on
+        which duplicates were collapsed.
+        '''
+        self.band_hash = {}
+        max_bucket_size = self.max_bucket_size
+        splitting = max_bucket_size is not None and self.oversized_bucket_strategy == 'split'
+        band_buckets = []
+        bucket_of_sample_by_band = {}            # only kept for sub-bucketing
+        for band_index in range(self.b):
+            buckets, bucket_of_sample = self._band_buckets(band_index)
+            band_buckets.append(buckets)
+            if splitting:
+                bucket_of_sample_by_band[band_index] = bucket_of_sample
+        oversized_buckets = [members for buckets in band_buckets for (_, members) in buckets
+                             if max_bucket_size is not None and len(members) > max_bucket_size]
+        collapsed = None
+        self.representative_of = self.sample_multiplicity = None
+        if oversized_buckets and self.oversized_bucket_strategy == 'collapse':
+            collapsed = self._collapse_duplicates(oversized_buckets)
+        elif oversized_buckets:
+            collapsed = self._collapse_duplicates(oversized_buckets, min_duplicates=max_bucket_size + 1)
+        sizes_before, sizes_after = [], []
+        for (band_index, buckets) in enumerate(band_buckets):
+            for (band_key, members) in buckets:
+                sizes_before.append(len(members))
+                if collapsed is not None:
+                    # a collapsed sample is in every bucket of its representative, so none is emptied
+                    members = members[~collapsed[members]]
+                if max_bucket_size is None or len(members) <= max_bucket_size:
+                    parts = [((), members)]
                 else:
-                    self.hash_store[hplane]['minus'].add(sample)
+                    # still too large, e.g. with only near duplicates in it, or not collapsing: split it
+                    parts = self._split_bucket(band_index, members, bucket_of_sample_by_band)
+                for (suffix, part) in parts:
+                    sizes_after.append(len(part))
+                    self.band_hash[(band_index, band_key) + suffix] = set(part.tolist())
+        sizes_before = numpy.array(sizes_before, dtype=numpy.int64)
+        sizes_after = numpy.array(sizes_after, dtype=numpy.int64)
+        self.bucket_stats = {
+            'buckets' : len(sizes_before),
+            'oversized_buckets' : len(oversized_buckets),
+            'largest_bucket_before' : int(sizes_before.max()) if len(sizes_before) else 0,
+            'largest_bucket_after' : int(sizes_after.max()) if len(sizes_after) else 0,
+            'still_oversized_buckets' : int((sizes_after > max_bucket_size).sum()) if max_bucket_size else 0,
+            'collapsed_samples' : int(collapsed.sum()) if collapsed is not None else 0,
+            'candidate_pairs_before' : int((sizes_before * (sizes_before - 1)).sum()),
+            'candidate_pairs_after' : int((sizes_after * (sizes_after - 1)).sum()),
+        }
+        self.bucket_stats['candidate_pairs_avoided'] = (self.bucket_stats['candidate_pairs_before'] -
+                                                        self.bucket_stats['candidate_pairs_after'])
 
     def lsh_basic_for_nearest_neighbors(self):
         '''
-        Regarding this implementation of LSH, note that each row of self.htable_rows corresponds to 
-        one hash function.  So if you have 3000 hash functions for 3000 different randomly chosen 
+        Regarding this implementation of LSH, note that each bit in a row of self.signatures corresponds
+        to one hash function.  So if you have 3000 hash functions for 3000 different randomly chosen 
         orientations of a hyperplane passing through the origin of the vector space in which the
-        numerical data is defined, this table has 3000 rows.  Each column of self.htable_rows is for
-        one data sample in the vector space.  So if you have 80 samples, then the table has 80 columns.
+        numerical data is defined, each row holds 3000 bits.  Each row of self.signatures is for
+        one data sample in the vector space.  So if you have 80 samples, then the matrix has 80 rows.
         The output of this method consists of an interactive session in which the user is asked to
         enter the symbolic name of a data record in the dataset processed by the LSH algorithm. The
         method then returns the names (some if not all) of the nearest neighbors of that data point.
         '''
-        for (i,_) in enumerate(sorted(self.hash_store)):
-            self.htable_rows[i] = BitVector(size = len(self._data_dict))
-        for (i,hplane) in enumerate(sorted(self.hash_store)):
-            self.index_to_hplane_mapping[i] = hplane
-            for (j,sample) in enumerate(sorted(self._data_dict, key=lambda x: sample_index(x))):        
-                if sample in self.hash_store[hplane]['plus']:
-                    self.htable_rows[i][j] =  1
-                elif sample in self.hash_store[hplane]['minus']:
-                    self.htable_rows[i][j] =  0
-                else:
-                    raise Exception("An untenable condition encountered")
-        for (i,_) in enumerate(sorted(self.hash_store)):
+        bits = self.unpacked_signature_bits()
+        for i in range(self.how_many_hashes):
             if i % self.r == 0: print()
-            print( str(self.htable_rows[i]) )
-        for (k,sample) in enumerate(sorted(self._data_dict, key=lambda x: sample_index(x))):                
-            for band_index in range(self.b):
-                bits_in_column_k = BitVector(bitlist = [self.htable_rows[i][k] for i in 
-                                                     range(band_index*self.r, (band_index+1)*self.r)])
-                key_index = "band" + str(band_index) + " " + str(bits_in_column_k)
-                if key_index not in self.band_hash:
-                    self.band_hash[key_index] = set()
-                    self.band_hash[key_index].add(sample)
-                else:
-                    self.band_hash[key_index].add(sample)
+            print( ''.join(map(str, bits[:,i].astype(int))) )
+        self._band_hash_all_data()
         if self._debug:
             print( "\n\nPre-Coalescence results:" )
             for key in sorted(self.band_hash, key=lambda x: band_hash_group_index(x)):
                 print()
-                print( "%s    =>   %s" % (key, str(self.band_hash[key])) )
-        similarity_neighborhoods = {sample_name : set() for sample_name in 
-                                         sorted(self._data_dict.keys(), key=lambda x: sample_index(x))}
-        for key in sorted(self.band_hash, key=lambda x: band_hash_group_index(x)):        
-            for sample_name in self.band_hash[key]:
-                similarity_neighborhoods[sample_name].update( set(self.band_hash[key]) - set([sample_name]) )
+                print( "%s    =>   %s" % (key, str(self.groups_by_sample_name([self.band_hash[key]])[0])) )
+        adjacency = self.lsh_basic_for_neighborhood_adjacency()
+        signal.signal(signal.SIGINT, Ctrl_c_handler)
         while True:
             sample_name = None
             if sys.version_info[0] == 3:
@@ -931,11 +1525,60 @@ class LocalitySensitiveHashing(object):
             else:
                 sample_name = raw_input('''\nEnter the symbolic name for a data sample '''
                                         '''(must match names used in your datafile): ''')
-            if sample_name in similarity_neighborhoods:
-                print( "\nThe nearest neighbors of the sample: %s" % str(similarity_neighborhoods[sample_name]) )
+            if sample_name in self._sample_ids:
+                sample_id = self._sample_ids[sample_name]
+                if self.representative_of is not None:
+                    sample_id = int(self.representative_of[sample_id])
+                neighbors = set(adjacency.indices[adjacency.indptr[sample_id]:adjacency.indptr[sample_id+1]].tolist())
+                print( "\nThe nearest neighbors of the sample: %s" % str(self.groups_by_sample_name([neighbors])[0]) )
             else:
                 print( "\nThe name you entered does not match any names in the database.  Try again." )
-        return similarity_neighborhoods
+        return adjacency
+
+    def lsh_basic_for_neighborhood_adjacency(self, block_size=2**18):
+        '''
+        Returns the similarity neighborhoods of the samples as a (samples x samples) scipy CSR
+        matrix with a True at (i, j) for every two distinct samples i and j that share a bucket in
+        at least one band.  The candidate pairs of the buckets are generated with numpy about
+        block_size at a time, as int64 keys that are sorted and made unique as they accumulate,
+        so that a pair found in many bands is stored once and no per-sample sets are built.  The
+        matrix is also kept in self.similarity_neighborhoods.
+        '''
+        from scipy.sparse import csr_matrix
+        if not self.band_hash:
+            self._band_hash_all_data()
+        how_many_samples = len(self._sample_names)
+        keys = numpy.zeros(0, dtype=numpy.int64)
+        pending, pairs_pending = [], 0           # deduplicated pair keys not yet merged into keys
+        batch, pairs_in_batch = [], 0
+        seen_buckets = set()
+        buckets = (bucket for bucket in self.band_hash.values() if len(bucket) > 1)
+        for bucket in itertools.chain(buckets, [None]):
+            if bucket is not None:
+                # a large bucket found again in another band, e.g. one of identical tweets, adds no pairs
+                if len(bucket) >= 64:
+                    members = frozenset(bucket)
+                    if members in seen_buckets:
+                        continue
+                    seen_buckets.add(members)
+                batch.append(numpy.fromiter(bucket, dtype=numpy.int64, count=len(bucket)))
+                pairs_in_batch += len(bucket) ** 2
+            if batch and (bucket is None or pairs_in_batch >= block_size):
+                pending.append(sorted_unique(bucket_pair_keys(batch, how_many_samples)))
+                pairs_pending += len(pending[-1])
+                batch, pairs_in_batch = [], 0
+            # merge once the pending keys outnumber the merged ones, for a linear number of sorted keys overall
+            if pending and (bucket is None or pairs_pending > max(block_size, len(keys))):
+                keys = sorted_unique(numpy.concatenate([keys] + pending))
+                pending, pairs_pending = [], 0
+        index_dtype = numpy.int32 if max(how_many_samples, len(keys)) < 2**31 else numpy.int64
+        indptr = numpy.zeros(how_many_samples + 1, dtype=index_dtype)
+        numpy.cumsum(numpy.bincount(keys // how_many_samples, minlength=how_many_samples), out=indptr[1:])
+        columns = (keys % how_many_samples).astype(index_dtype)
+        del keys
+        self.similarity_neighborhoods = csr_matrix((numpy.ones(len(columns), dtype=bool), columns, indptr),
+                                                   shape=(how_many_samples, how_many_samples))
+        return self.similarity_neighborhoods
 
     def lsh_basic_for_neighborhood_clusters(self):
         '''
@@ -943,52 +1586,18 @@ class LocalitySensitiveHashing(object):
         sense: Whereas the previous method outputs a hash table whose keys are the data sample names
         and whose values are the immediate neighbors of the key sample names, this method merges
         the keys with the values to create neighborhood clusters.  These clusters are returned as 
-        a list of similarity groups, with each group being a set.
+        a sequence of similarity groups, with each group being a set of integer sample ids.  The
+        neighborhoods are kept as the CSR matrix of lsh_basic_for_neighborhood_adjacency(), and the
+        set of a group is only built when the group is read.
         '''
-        for (i,_) in enumerate(sorted(self.hash_store)):
-            self.htable_rows[i] = BitVector(size = len(self._data_dict))
-        for (i,hplane) in enumerate(sorted(self.hash_store)):
-            self.index_to_hplane_mapping[i] = hplane
-            for (j,sample) in enumerate(sorted(self._data_dict, key=lambda x: sample_index(x))):        
-                if sample in self.hash_store[hplane]['plus']:
-                    self.htable_rows[i][j] =  1
-                elif sample in self.hash_store[hplane]['minus']:
-                    self.htable_rows[i][j] =  0
-                else:
-                    raise Exception("An untenable condition encountered")
-        # for (i,_) in enumerate(sorted(self.hash_store)):
-        #     if i % self.r == 0: print
-        #     print( str(self.htable_rows[i]) ) 
-        for (k,sample) in enumerate(sorted(self._data_dict, key=lambda x: sample_index(x))):                
-            for band_index in range(self.b):
-                bits_in_column_k = BitVector(bitlist = [self.htable_rows[i][k] for i in 
-                                                     range(band_index*self.r, (band_index+1)*self.r)])
-                key_index = "band" + str(band_index) + " " + str(bits_in_column_k)
-                if key_index not in self.band_hash:
-                    self.band_hash[key_index] = set()
-                    self.band_hash[key_index].add(sample)
-                else:
-                    self.band_hash[key_index].add(sample)
+        self._band_hash_all_data()
         if self._debug:
             print("\n\nPre-Coalescence results:")
             for key in sorted(self.band_hash, key=lambda x: band_hash_group_index(x)):
                 print()
-                print( "%s    =>    %s" % (key, str(self.band_hash[key])) )
-        similarity_neighborhoods = {sample_name : set() for sample_name in 
-                                         sorted(self._data_dict.keys(), key=lambda x: sample_index(x))}
-        for key in sorted(self.band_hash, key=lambda x: band_hash_group_index(x)):        
-            for sample_name in self.band_hash[key]:
-                similarity_neighborhoods[sample_name].update( set(self.band_hash[key]) - set([sample_name]) )
-        # print("\n\nSimilarity neighborhoods calculated by the basic LSH algo:")
-        for key in sorted(similarity_neighborhoods, key=lambda x: sample_index(x)):
-            # print( "\n  %s   =>  %s" % (key, str(sorted(similarity_neighborhoods[key], key=lambda x: sample_index(x)))) )
-            simgroup = set(similarity_neighborhoods[key])
-            simgroup.add(key)
-            self.similarity_groups.append(simgroup)
-        # print( "\n\nSimilarity groups calculated by the basic LSH algo:\n" )
-        # for group in self.similarity_groups:
-        #     print(str(group))
-        #     print()
+                print( "%s    =>    %s" % (key, str(self.groups_by_sample_name([self.band_hash[key]])[0])) )
+        self.similarity_groups = NeighborhoodGroups(self.lsh_basic_for_neighborhood_adjacency(),
+                                                    self.representative_of)
         # print( "\nTotal number of similarity groups found by the basic LSH algo: %d" % len(self.similarity_groups) )
         return self.similarity_groups
 
@@ -998,24 +1607,25 @@ class LocalitySensitiveHashing(object):
         with an implementation of LSH.  We take the clusters produced by the method 
         lsh_basic_for_neighborhood_clusters() and we coalesce them based on the basis of shared data samples.
         That is, if two neighborhood clusters represented by the sets A and B have any data elements in 
-        common, we merge A and B by forming the union of the two sets.
+        common, we merge A and B by forming the union of the two sets.  The groups are taken in order in
+        a single pass, and a group is unioned into every merged group it shares a sample with, so the
+        merged groups can overlap.  Instead of intersecting each group with all the merged groups, the
+        merged groups that hold a sample are looked up in an index from sample ids to merged groups.
         '''
         merged_similarity_groups = []
+        merged_groups_holding = {}    # sample id => indices of the merged groups that hold it
         for group in similarity_groups:
-            if len(merged_similarity_groups) == 0:
-                merged_similarity_groups.append(group)
-            else:
-                new_merged_similarity_groups = []
-                merge_flag = 0
-                for mgroup in merged_similarity_groups:
-                    if len(set.intersection(group, mgroup)) > 0:
-                        new_merged_similarity_groups.append(mgroup.union(group))
-                        merge_flag = 1
-                    else:
-                       new_merged_similarity_groups.append(mgroup)
-                if merge_flag == 0:
-                    new_merged_similarity_groups.append(group)     
-                merged_similarity_groups = list(map(set, new_merged_similarity_groups))
+            overlapping = set()
+            for sample_id in group:
+                overlapping.update(merged_groups_holding.get(sample_id, ()))
+            if len(overlapping) == 0:
+                overlapping = [len(merged_similarity_groups)]
+                merged_similarity_groups.append(set())
+            for index in overlapping:
+                mgroup = merged_similarity_groups[index]
+                for sample_id in group - mgroup:
+                    merged_groups_holding.setdefault(sample_id, []).append(index)
+                mgroup |= group
         # for group in merged_similarity_groups:
             # print( str(group) )
             # print()
@@ -1023,6 +1633,54 @@ class LocalitySensitiveHashing(object):
         self.coalescence_merged_similarity_groups = merged_similarity_groups
         return merged_similarity_groups
 
+    def merge_similarity_groups_with_union_find(self):
+        '''
+        Coalesces the buckets in self.band_hash into the connected components of a disjoint-set
+        forest in which all the samples in a bucket are unioned.  This takes near-linear time in
+        the total size of the buckets.  It must be called after lsh_basic_for_neighborhood_clusters().
+        The groups are not those of the previous method: there, a group that overlaps several
+        already merged groups is unioned into each of them but does not join them, whereas here
+        every chain of shared samples ends up in one group, so there are fewer, larger groups.
+        '''
+        forest = DisjointSet(len(self._sample_names))
+        for bucket in self.band_hash.values():
+            members = list(bucket)
+            for sample_id in members[1:]:
+                forest.union(members[0], sample_id)
+        if self.representative_of is not None:
+            for (sample_id, representative) in enumerate(self.representative_of.tolist()):
+                if sample_id != representative:
+                    forest.union(representative, sample_id)
+        merged_similarity_groups = list(map(set, forest.groups()))
+        self.coalescence_merged_similarity_groups = merged_similarity_groups
+        return merged_similarity_groups
+
+    def group_weight(self, group):
+        '''
+        The number of samples in a group of sample ids, counting each sample as many times as its
+        weight if the data was loaded with weights.
+        '''
+        if self.sample_weights is None:
+            return len(group)
+        return int(self.sample_weights[numpy.fromiter(group, dtype=numpy.intp, count=len(group))].sum())
+
+    def _group_means(self, groups):
+        '''
+        Returns a (groups x dim) array of the mean data vector of each group of sample ids, weighted
+        by the sample weights if there are any.  The rows of all the groups are gathered in one
+        fancy-indexing step and summed group by group with a single numpy.add.reduceat() over the
+        gathered rows.
+        '''
+        sizes = numpy.array([len(group) for group in groups], dtype=numpy.intp)
+        rows = numpy.fromiter(itertools.chain.from_iterable(groups), dtype=numpy.intp, count=int(sizes.sum()))
+        starts = numpy.concatenate(([0], numpy.cumsum(sizes)[:-1]))
+        vectors = numpy.asarray(self._data_matrix[rows], dtype=numpy.float64)
+        if self.sample_weights is None:
+            return numpy.add.reduceat(vectors, starts, axis=0) / sizes[:,None]
+        weights = self.sample_weights[rows].astype(numpy.float64)
+        return (numpy.add.reduceat(vectors * weights[:,None], starts, axis=0) /
+                numpy.add.reduceat(weights, starts)[:,None])
+
     def merge_similarity_groups_with_l2norm_sample_based(self, similarity_groups):
         '''
         The neighborhood set coalescence as carried out by the previous method will generally result
@@ -1030,43 +1688,23 @@ class LocalitySensitiveHashing(object):
         find in your data. This method first orders the clusters (called 'similarity groups') according 
         to their size.  It then pools together the data samples in the trailing excess similarity groups.  
         Subsequently, for each data sample in the pool, it merges that sample with the closest larger 
-        group.
+        group.  The group means and the distances from all the pooled samples to them are computed
+        with numpy in one pass, rather than one l2norm() call per sample and group.
         '''
-        similarity_group_mean_values = {}
-        for group in similarity_groups:            #  A group is a set of sample names
-            vector_list = [self._data_dict[sample_name] for sample_name in group]
-            group_mean = [float(sum(col))/len(col) for col in zip(*vector_list)]
-            similarity_group_mean_values[str(group)] = group_mean
-            if self._debug:
-                print( "\n\nCLUSTER MEAN: %f" % group_mean )
-        new_similarity_groups = []
-        key_to_small_group_mapping = {}
-        key_to_large_group_mapping = {}
-        stringified_list = [str(item) for item in similarity_groups]
-        small_group_pool_for_a_given_large_group = {x : [] for x in stringified_list}
         if len(similarity_groups) > self.expected_num_of_clusters:
-            ordered_sim_groups_by_size = sorted(similarity_groups, key=lambda x: len(x), reverse=True)
+            ordered_sim_groups_by_size = sorted(similarity_groups, key=self.group_weight, reverse=True)
             retained_similarity_groups = ordered_sim_groups_by_size[:self.expected_num_of_clusters]
             straggler_groups = ordered_sim_groups_by_size[self.expected_num_of_clusters :]
-            # print( "\n\nStraggler groups: %s" % str(straggler_groups) )
-            samples_in_stragglers =  sum([list(group) for group in straggler_groups], [])
-            # print( "\n\nSamples in stragglers: %s" %  str(samples_in_stragglers) )
-            straggler_sample_to_closest_retained_group_mapping = {sample : None for sample in samples_in_stragglers}
-            for sample in samples_in_stragglers:
-                dist_to_closest_retained_group_mean, closest_retained_group = None, None
-                for group in retained_similarity_groups:
-                        dist = l2norm(similarity_group_mean_values[str(group)], self._data_dict[sample])
-                        if dist_to_closest_retained_group_mean is None:
-                            dist_to_closest_retained_group_mean = dist
-                            closest_retained_group = group
-                        elif dist < dist_to_closest_retained_group_mean:
-                            dist_to_closest_retained_group_mean = dist
-                            closest_retained_group = group
-                        else:
-                            pass
-                straggler_sample_to_closest_retained_group_mapping[sample] = closest_retained_group
-            for sample in samples_in_stragglers:
-                straggler_sample_to_closest_retained_group_mapping[sample].add(sample)
+            retained_group_means = self._group_means(retained_similarity_groups)
+            if self._debug:
+                for group_mean in retained_group_means:
+                    print( "\n\nCLUSTER MEAN: %s" % str(group_mean.tolist()) )
+            samples_in_stragglers = numpy.fromiter(itertools.chain.from_iterable(straggler_groups),
+                                                   dtype=numpy.intp)
+            closest_retained_groups = closest_mean_indices(self._data_matrix[samples_in_stragglers],
+                                                           retained_group_means)
+            for sample, group_index in zip(samples_in_stragglers.tolist(), closest_retained_groups.tolist()):
+                retained_similarity_groups[group_index].add(sample)
             # print( "\n\nDisplaying sample based l2 norm merged similarity groups:" )
             self.merged_similarity_groups_with_l2norm = retained_similarity_groups
             # for group in self.merged_similarity_groups_with_l2norm:
@@ -1084,61 +1722,41 @@ class LocalitySensitiveHashing(object):
         we now merge the excess similarity groups wholesale with the retained similarity 
         groups.  For each excess similarity group, we find the closest retained similarity group,
         closest in terms of the l2 norm distance between the mean values of the two groups.
-        '''    
-        similarity_group_mean_values = {}
-        for group in similarity_groups:                # A group is a set of sample names
-            vector_list = [self._data_dict[sample_name] for sample_name in group]
-            group_mean = [float(sum(col))/len(col) for col in zip(*vector_list)]
-            similarity_group_mean_values[str(group)] = group_mean
-            if self._debug:
-                print( "\n\nCLUSTER MEAN: %f" % group_mean )
+        Groups are referred to by their integer position in the size ordering, their means are
+        the rows of one matrix, and all the straggler-to-retained distances are computed with
+        numpy at once.  The pools of small groups are only printed in debug mode.
+        '''
         if len(similarity_groups) > self.expected_num_of_clusters:
-            new_similarity_groups = []
-            key_to_small_group_mapping = {}
-            key_to_large_group_mapping = {}
-            ordered_sim_groups_by_size = sorted(similarity_groups, key=lambda x: len(x), reverse=True)
+            ordered_sim_groups_by_size = sorted(similarity_groups, key=self.group_weight, reverse=True)
             retained_similarity_groups = ordered_sim_groups_by_size[:self.expected_num_of_clusters]
             straggler_groups = ordered_sim_groups_by_size[self.expected_num_of_clusters :]
-            # print( "\n\nStraggler groups: %s" % str(straggler_groups) )
-            # print( "\n\nNumber of samples in retained groups: %d" % len(list(set.union(*retained_similarity_groups))) )
-            # print( "\n\nNumber of samples in straggler groups: %d" % len(list(set.union(*straggler_groups))) )
-            retained_stringified_list = [str(item) for item in retained_similarity_groups]
-            small_group_pool_for_a_given_large_group = {x : [] for x in retained_stringified_list}
-            for group1 in straggler_groups:
-                key_to_small_group_mapping[str(group1)] = group1
-                dist_to_closest_large_group_mean, closest_large_group = None, None
-                for group2 in retained_similarity_groups:
-                    key_to_large_group_mapping[str(group2)] = group2
-                    dist = l2norm(similarity_group_mean_values[str(group2)], similarity_group_mean_values[str(group1)])
-                    if dist_to_closest_large_group_mean is None:
-                        dist_to_closest_large_group_mean = dist
-                        closest_large_group = group2
-                    elif dist < dist_to_closest_large_group_mean:
-                        dist_to_closest_large_group_mean = dist
-                        closest_large_group = group2
-                    else:
-                        pass
-                small_group_pool_for_a_given_large_group[str(closest_large_group)].append(group1)
-            if any(len(small_group_pool_for_a_given_large_group[x]) > 0 for x in small_group_pool_for_a_given_large_group):
-                print( "\n\nTHERE IS NON-ZERO POOL FOR MERGING FOR AT LEAST ONE LARGER SIMILARITY GROUPS" )
-                print( str(small_group_pool_for_a_given_large_group.values()) )
-            for key in small_group_pool_for_a_given_large_group:
-                lgroup = key_to_large_group_mapping[key]
-                list_fo_small_groups = small_group_pool_for_a_given_large_group[key]
-                print( "\n\nFor group %s, the pool of small groups for merging =====>  %s" % 
-                                                                          (str(lgroup), str(list_fo_small_groups)) )
-            for group in sorted(retained_similarity_groups, key=lambda x: len(x), reverse=True):
+            # Row i of group_means is the mean of ordered_sim_groups_by_size[i], so a group is
+            # identified by its position in that list rather than by str() of its samples:
+            group_means = self._group_means(ordered_sim_groups_by_size)
+            if self._debug:
+                for group_mean in group_means:
+                    print( "\n\nCLUSTER MEAN: %s" % str(group_mean.tolist()) )
+            closest_retained_groups = closest_mean_indices(group_means[self.expected_num_of_clusters:],
+                                                           group_means[:self.expected_num_of_clusters])
+            small_group_pool_for_a_given_large_group = [[] for _ in retained_similarity_groups]
+            for straggler_index, group_index in enumerate(closest_retained_groups.tolist()):
+                small_group_pool_for_a_given_large_group[group_index].append(straggler_index)
+            if self._debug:
+                for group_index, pool in enumerate(small_group_pool_for_a_given_large_group):
+                    print( "\n\nFor group %s, the pool of small groups for merging =====>  %s" % 
+                           (str(self.groups_by_sample_name([retained_similarity_groups[group_index]])[0]),
+                            str(self.groups_by_sample_name([straggler_groups[i] for i in pool]))) )
+            new_similarity_groups = []
+            for group_index, group in enumerate(retained_similarity_groups):
                 group_copy = set(group)     # shallow copy
-                if len(small_group_pool_for_a_given_large_group[str(group)]) > 0:
-                    for setitem in small_group_pool_for_a_given_large_group[str(group)]:
-                        group_copy.update(setitem)  
-                    new_similarity_groups.append(group_copy)
-                else:
-                    new_similarity_groups.append(group_copy)
+                for straggler_index in small_group_pool_for_a_given_large_group[group_index]:
+                    group_copy.update(straggler_groups[straggler_index])
+                new_similarity_groups.append(group_copy)
             self.merged_similarity_groups_with_l2norm = new_similarity_groups
-            print( "\n\nDisplaying set based l2 norm merged similarity groups:")
-            for group in new_similarity_groups:
-                print( str(group) )
+            if self._debug:
+                print( "\n\nDisplaying set based l2 norm merged similarity groups:")
+                for group in self.groups_by_sample_name(new_similarity_groups):
+                    print( str(group) )
             return new_similarity_groups
         else:
             print('''\n\nNo set based merging carried out since the number of clusters yielded by coalescence '''
@@ -1159,14 +1777,14 @@ class LocalitySensitiveHashing(object):
                                                         self.similarity_group_min_size_threshold]
         print( "\nNumber of similarity groups after pruning: %d" % len(self.pruned_similarity_groups) )      
         print( "\nPruned similarity groups: " )
-        for group in self.pruned_similarity_groups:
+        for group in self.groups_by_sample_name(self.pruned_similarity_groups):
             print( str(group) )
         return self.pruned_similarity_groups
 
     def evaluate_quality_of_similarity_groups(self, evaluation_similarity_groups):
         '''
-        The argument to this method, evaluation_similarity_groups, is a list of sets, with each set being 
-        a similarity group, which is the same thing as a cluster.
+        The argument to this method, evaluation_similarity_groups, is a list of sets of sample ids, with 
+        each set being a similarity group, which is the same thing as a cluster.
 
         If you plan to invoke this method to evaluate the quality of clustering achieved by the values
         used for the parameters r and b, you'd want the data records in the CSV datafile to look like:
@@ -1180,17 +1798,17 @@ class LocalitySensitiveHashing(object):
         print( '''\n\nWe measure the quality of a similarity group by taking stock of how many '''
                '''different different input similarity groups are in the same output similarity group.''')
         sample_classes = set()
-        for item in sorted(self._data_dict.items(), key = lambda x: sample_index(x[0]) ):
-            sample_classes.add(item[0][:item[0].find(r'_')])
+        for sample_name in self._sample_names:
+            sample_classes.add(sample_name[:sample_name.find(r'_')])
         self.evaluation_classes = sample_classes
         if len(self.evaluation_classes) == 0:
             sys.exit('''\n\nUnable to figure out the number of data classes in the datafile processed by '''
                      '''this module --- aborting''')                     
         total_num_samples_in_all_similarity_groups = 0
         print( "\n\nTotal number of similarity groups tested: %d" % len(evaluation_similarity_groups) )
-        m = re.search('^([a-zA-Z]+).+_', list(self._data_dict.keys())[0])
+        m = re.search('^([a-zA-Z]+).+_', self._sample_names[0])
         sample_name_stem = m.group(1)
-        for group in sorted(evaluation_similarity_groups, key=lambda x: len(x), reverse=True):
+        for group in sorted(self.groups_by_sample_name(evaluation_similarity_groups), key=lambda x: len(x), reverse=True):
             total_num_samples_in_all_similarity_groups += len(group)
             set_for_sample_ids_in_group = set()
             how_many_uniques_in_each_group = {g : 0 for g in self.evaluation_classes}
@@ -1213,21 +1831,23 @@ class LocalitySensitiveHashing(object):
 
     def write_clusters_to_file(self, clusters, filename):
         FILEOUT = open(filename, 'w')
-        for cluster in clusters:
+        for cluster in self.groups_by_sample_name(clusters):
             FILEOUT.write( str(cluster) + "\n\n" )
         FILEOUT.close()
 
     def show_sample_to_initial_similarity_group_mapping(self):
-        self.sample_to_similarity_group_mapping = {sample : [] for sample in self._data_dict}
-        for sample in sorted(self._data_dict.keys(), key=lambda x: sample_index(x)):        
+        self.sample_to_similarity_group_mapping = {sample : [] for sample in range(len(self._sample_names))}
+        for sample in range(len(self._sample_names)):
             for key in sorted(self.coalesced_band_hash, key=lambda x: band_hash_group_index(x)):            
                 if (self.coalesced_band_hash[key] is not None) and (sample in self.coalesced_band_hash[key]):
                     self.sample_to_similarity_group_mapping[sample].append(key)
         print( "\n\nShowing sample to initial similarity group mappings:" )
-        for sample in sorted(self.sample_to_similarity_group_mapping.keys(), key=lambda x: sample_index(x)):
-            print( "\n %s     =>    %s" % (sample, str(self.sample_to_similarity_group_mapping[sample])) )
+        for sample in sorted(self.sample_to_similarity_group_mapping.keys()):
+            print( "\n %s     =>    %s" % (self._sample_names[sample], str(self.sample_to_similarity_group_mapping[sample])) )
 
     def display_contents_of_all_hash_bins_pre_lsh(self):
+        if not self.hash_store:
+            self.build_hash_store_view()
         for hplane in self.hash_store:
             print( "\n\n hyperplane: %s" % str(hplane) )
             print( "\n samples in plus bin: %s" % str(self.hash_store[hplane]['plus']) )
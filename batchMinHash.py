@@ -0,0 +1,88 @@
+'''
+Batched MinHash signatures for all the rows of a sparse document-feature
+matrix at once.
+
+Each document is treated as the set of its nonzero feature columns.  The
+32-bit SHA1 hash of every feature is computed once, the universal hash
+permutations are applied to the hashes of all the nonzeros of a block of
+documents in one vectorized step, and the per-document minima are taken
+with numpy.minimum.reduceat over the CSR row segments.
+
+The permutations and the arithmetic are those of datasketch's MinHash in
+its 'legacy' scheme (the only scheme before datasketch 2.0), so for the same
+seed the signature of a row equals the hashvalues of a datasketch MinHash
+updated with the encoded names of the row's features.  Because permutation
+i depends only on the seed and i, the first k columns of a signature are
+themselves a valid k-permutation signature.
+'''
+import hashlib
+import struct
+
+import numpy
+from scipy.sparse import csr_matrix
+
+mersenne_prime = numpy.uint64((1 << 61) - 1)
+max_hash = numpy.uint64((1 << 32) - 1)
+
+
+def sha1_hash32(data):
+    """The default hash function of datasketch's MinHash"""
+    return struct.unpack('<I', hashlib.sha1(data).digest()[:4])[0]
+
+
+def feature_hashes(feature_names):
+    """32-bit hash of each feature name, as MinHash.update(name.encode('utf8')) would compute it"""
+    return numpy.array([sha1_hash32(name.encode('utf8')) for name in feature_names], dtype=numpy.uint64)
+
+
+def permutations(num_perm, seed=1):
+    """The (a, b) parameters of the num_perm universal hash permutations for a seed"""
+    generator = numpy.random.RandomState(seed)
+    params = numpy.array([(generator.randint(1, mersenne_prime, dtype=numpy.uint64),
+                           generator.randint(0, mersenne_prime, dtype=numpy.uint64))
+                          for _ in range(num_perm)], dtype=numpy.uint64)
+    return params[:, 0], params[:, 1]
+
+
+def minhash_signatures(X, num_perm=128, seed=1, hashes=None, block_size=2**22):
+    """
+    Return the (documents x num_perm) uint64 MinHash signature matrix of the
+    rows of X.  hashes gives the 32-bit hash of every column of X; it defaults
+    to the hashes of the column indices written out as strings.  Documents
+    with no nonzero features get the all-max_hash signature of an empty MinHash.
+    block_size bounds the number of (nonzero, permutation) values computed at
+    a time.
+    """
+    X = csr_matrix(X)
+    X.eliminate_zeros()
+    if hashes is None:
+        hashes = feature_hashes(str(column) for column in range(X.shape[1]))
+    a, b = permutations(num_perm, seed)
+    signatures = numpy.full((X.shape[0], num_perm), max_hash, dtype=numpy.uint64)
+    indptr = X.indptr
+    nonzeros_per_block = max(1, block_size // num_perm)
+    start_row = 0
+    while start_row < X.shape[0]:
+        # as many whole rows as fit in the block, but always at least one
+        end_row = numpy.searchsorted(indptr, indptr[start_row] + nonzeros_per_block, side='right') - 1
+        end_row = min(max(end_row, start_row + 1), X.shape[0])
+        row_starts = indptr[start_row:end_row]
+        non_empty = row_starts < indptr[start_row + 1:end_row + 1]
+        if non_empty.any():
+            hv = hashes[X.indices[indptr[start_row]:indptr[end_row]]][:, numpy.newaxis]
+            phv = numpy.bitwise_and((hv * a + b) % mersenne_prime, max_hash)
+            minima = numpy.minimum.reduceat(phv, row_starts[non_empty] - indptr[start_row], axis=0)
+            signatures[start_row:end_row][non_empty] = minima
+        start_row = end_row
+    return signatures
+
+
+def multi_resolution_signatures(X, perm_sizes, seed=1, hashes=None, block_size=2**22):
+    """
+    Return {num_perm: signature} for every size in perm_sizes, hashing X only
+    once at the largest size.  The smaller signatures are column-prefix views
+    of the largest one, with no extra hashing or copying, and are identical
+    to what minhash_signatures() returns for those sizes.
+    """
+    full = minhash_signatures(X, num_perm=max(perm_sizes), seed=seed, hashes=hashes, block_size=block_size)
+    return dict((num_perm, full[:, :num_perm]) for num_perm in perm_sizes)
@@ -0,0 +1,838 @@
+'''
+Timing benchmarks for the stages of the trending-topic pipeline.  Run all of
+them with
+
+    python benchmark.py
+
+or only some of them by naming them on the command line, e.g.
+
+    python benchmark.py coalescence
+'''
+import itertools
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy
+# also loads scipy.sparse, which the LSH neighborhoods otherwise import in the first timed call
+from scipy.sparse import vstack
+
+from ELocalitySensitiveHashing import LocalitySensitiveHashing, cleanup_csv, convert
+
+# Sizes of the tweet samples used for the runs in result/*.csv
+dataset_sizes = [1000, 2000, 5000]
+
+
+def clustered_samples(how_many, dim=64, how_many_clusters=50, spread=0.05, seed=0):
+    """Gaussian blobs around random centers, a stand-in for the signatures of ds.csv"""
+    rng = numpy.random.RandomState(seed)
+    centers = rng.uniform(-1.0, 1.0, size=(how_many_clusters, dim))
+    labels = rng.randint(how_many_clusters, size=how_many)
+    return centers[labels] + rng.normal(scale=spread, size=(how_many, dim))
+
+
+def load_tweets(how_many=None, filename='ds.csv'):
+    import pandas as pd
+    tweets = pd.read_csv(filename).review.fillna('').astype(str)
+    return tweets.tolist() if how_many is None else tweets[:how_many].tolist()
+
+
+def peak_memory(function, *args):
+    """Run function(*args) and return its result with the peak traced allocation in MB"""
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak / 2.0**20
+
+
+def write_samples_to_csv(data, filename):
+    with open(filename, 'w') as output:
+        for index, row in enumerate(data):
+            output.write("doc_" + str(index) + "," + ",".join(map(repr, row.tolist())) + "\n")
+
+
+def legacy_csv_parse(filename, cleanup):
+    """The per-line parse that get_data_from_csv() used before the chunked loader"""
+    data_dict = {}
+    with open(filename) as f:
+        for line in f:
+            record = cleanup_csv(line) if cleanup else line
+            parts = record.rstrip().split(r',')
+            data_dict[parts[0].strip('"')] = list(map(convert, parts[1:]))
+    return data_dict
+
+
+def hashed_lsh(data, r=50, b=100, seed=0):
+    """A LocalitySensitiveHashing instance with the band buckets of data filled in"""
+    lsh = LocalitySensitiveHashing.from_array(data, r=r, b=b, expected_num_of_clusters=5)
+    numpy.random.seed(seed)
+    lsh.initialize_hash_store()
+    lsh.hash_all_data()
+    return lsh
+
+
+def tweet_signatures(tweets, num_perm=128, ngram_size=2):
+    """MinHash signatures of the word n-grams of tweets, as lsHash.py computes them"""
+    from batchMinHash import minhash_signatures
+    from tweetStream import ngram_shingles, shingle_matrix
+    X, hashes = shingle_matrix(ngram_shingles(tweets, [ngram_size])[ngram_size])
+    return minhash_signatures(X, num_perm=num_perm, seed=3, hashes=hashes)
+
+
+def legacy_coalescence(similarity_groups):
+    """The pairwise set intersections that merge_similarity_groups_with_coalescence() used to run"""
+    merged_similarity_groups = []
+    for group in similarity_groups:
+        if len(merged_similarity_groups) == 0:
+            merged_similarity_groups.append(group)
+        else:
+            new_merged_similarity_groups = []
+            merge_flag = 0
+            for mgroup in merged_similarity_groups:
+                if len(set.intersection(group, mgroup)) > 0:
+                    new_merged_similarity_groups.append(mgroup.union(group))
+                    merge_flag = 1
+                else:
+                    new_merged_similarity_groups.append(mgroup)
+            if merge_flag == 0:
+                new_merged_similarity_groups.append(group)
+            merged_similarity_groups = list(map(set, new_merged_similarity_groups))
+    return merged_similarity_groups
+
+
+def bench_coalescence(tweet_counts=(5000, None)):
+    """The merges on synthetic samples, and with lsHash.py's r and b on the MinHash signatures of ds.csv"""
+    print("Coalescence: pairwise set intersection vs indexed single pass vs union-find over band_hash")
+    runs = [("synthetic", lambda size=size: hashed_lsh(clustered_samples(size), r=16, b=20))
+            for size in dataset_sizes]
+    runs += [("ds.csv", lambda how_many=how_many: hashed_lsh(tweet_signatures(load_tweets(how_many))))
+             for how_many in tweet_counts]
+    for label, make_lsh in runs:
+        lsh = make_lsh()
+        size = lsh.how_many_data_samples
+        similarity_groups = lsh.lsh_basic_for_neighborhood_clusters()
+
+        start = time.time()
+        pairwise = legacy_coalescence(similarity_groups)
+        pairwise_time = time.time() - start
+
+        start = time.time()
+        indexed = lsh.merge_similarity_groups_with_coalescence(similarity_groups)
+        indexed_time = time.time() - start
+        assert indexed == pairwise, "the indexed coalescence differs from the pairwise one"
+
+        start = time.time()
+        union_find = lsh.merge_similarity_groups_with_union_find()
+        union_find_time = time.time() - start
+
+        # the coalescence makes one greedy pass, so where it differs it leaves apart, or
+        # keeps several copies of, groups that union-find joins through a chain of shared samples
+        differing = list((Counter(map(frozenset, union_find)) - Counter(map(frozenset, pairwise))).elements())
+        differing += list((Counter(map(frozenset, pairwise)) - Counter(map(frozenset, union_find))).elements())
+        print("  %-9s %5d samples: %8.3f s pairwise, %8.3f s indexed (%d groups, same groups), "
+              "%8.3f s union-find (%d groups), union-find groups the same: %s (%d groups differ)"
+              % (label, size, pairwise_time, indexed_time, len(pairwise), union_find_time, len(union_find),
+                 not differing, len(differing)))
+
+
+def legacy_l2norm_sample_based(data_matrix, similarity_groups, expected_num_of_clusters):
+    """The per-sample, per-group loop that merge_similarity_groups_with_l2norm_sample_based() used to run"""
+    from ELocalitySensitiveHashing import l2norm
+    similarity_group_mean_values = {}
+    for group in similarity_groups:
+        vector_list = [data_matrix[sample_name] for sample_name in group]
+        similarity_group_mean_values[str(group)] = [float(sum(col)) / len(col) for col in zip(*vector_list)]
+    ordered_sim_groups_by_size = sorted(similarity_groups, key=lambda x: len(x), reverse=True)
+    retained_similarity_groups = ordered_sim_groups_by_size[:expected_num_of_clusters]
+    straggler_groups = ordered_sim_groups_by_size[expected_num_of_clusters:]
+    samples_in_stragglers = sum([list(group) for group in straggler_groups], [])
+    closest = {}
+    for sample in samples_in_stragglers:
+        best = None
+        for group in retained_similarity_groups:
+            dist = l2norm(similarity_group_mean_values[str(group)], data_matrix[sample])
+            if best is None or dist < best:
+                best, closest[sample] = dist, group
+    for sample in samples_in_stragglers:
+        closest[sample].add(sample)
+    return retained_similarity_groups
+
+
+def bench_l2norm_merge(sizes=(1000, 2000, 5000)):
+    print("Sample based l2 norm merge: per-pair l2norm() vs blocked numpy distances")
+    for size in sizes:
+        samples = clustered_samples(size, how_many_clusters=size // 4, spread=0.1)
+        # integer vectors like the MinHash signatures of lsHash.py, with the same cluster structure
+        signatures = ((samples + 2.0) * 2**30).astype(numpy.uint64)
+        for name, data in (('float', samples), ('integer', signatures)):
+            lsh = hashed_lsh(samples, r=32, b=10)
+            lsh._data_matrix = data
+            lsh.lsh_basic_for_neighborhood_clusters()
+            similarity_groups = lsh.merge_similarity_groups_with_union_find()
+
+            start = time.time()
+            legacy = legacy_l2norm_sample_based(data, [set(group) for group in similarity_groups], 5)
+            legacy_time = time.time() - start
+
+            start = time.time()
+            merged = lsh.merge_similarity_groups_with_l2norm_sample_based([set(group) for group in similarity_groups])
+            merged_time = time.time() - start
+
+            print("  %5d %-7s samples, %4d groups: %8.3f s per pair, %7.3f s vectorized (%5.1fx), same groups: %s"
+                  % (size, name, len(similarity_groups), legacy_time, merged_time, legacy_time / merged_time,
+                     legacy == merged))
+
+
+def legacy_l2norm_set_based(lsh, similarity_groups, expected_num_of_clusters):
+    """The str(group)-keyed loop that merge_similarity_groups_with_l2norm_set_based() used to run, printing included"""
+    from ELocalitySensitiveHashing import l2norm
+    similarity_group_mean_values = {}
+    for group in similarity_groups:
+        vector_list = [lsh._data_matrix[sample_name] for sample_name in group]
+        similarity_group_mean_values[str(group)] = [float(sum(col)) / len(col) for col in zip(*vector_list)]
+    key_to_large_group_mapping = {}
+    ordered_sim_groups_by_size = sorted(similarity_groups, key=lambda x: len(x), reverse=True)
+    retained_similarity_groups = ordered_sim_groups_by_size[:expected_num_of_clusters]
+    straggler_groups = ordered_sim_groups_by_size[expected_num_of_clusters:]
+    pools = dict((str(group), []) for group in retained_similarity_groups)
+    for group1 in straggler_groups:
+        best, closest = None, None
+        for group2 in retained_similarity_groups:
+            key_to_large_group_mapping[str(group2)] = group2
+            dist = l2norm(similarity_group_mean_values[str(group2)], similarity_group_mean_values[str(group1)])
+            if best is None or dist < best:
+                best, closest = dist, group2
+        pools[str(closest)].append(group1)
+    print(str([lsh.groups_by_sample_name(pool) for pool in pools.values()]))
+    for key in pools:
+        print("For group %s, the pool of small groups for merging =====>  %s"
+              % (str(lsh.groups_by_sample_name([key_to_large_group_mapping[key]])[0]),
+                 str(lsh.groups_by_sample_name(pools[key]))))
+    new_similarity_groups = []
+    for group in retained_similarity_groups:
+        group_copy = set(group)
+        for setitem in pools[str(group)]:
+            group_copy.update(setitem)
+        new_similarity_groups.append(group_copy)
+    for group in lsh.groups_by_sample_name(new_similarity_groups):
+        print(str(group))
+    return new_similarity_groups
+
+
+def bench_set_merge(sizes=(2000, 20000, 100000), dim=64, legacy_limit=20000):
+    """Set based l2 norm merge over many small groups, with the old loop's output sent to a buffer"""
+    import contextlib
+    import io
+    print("Set based l2 norm merge: str(group) keys and l2norm() per pair vs group ids and a mean matrix")
+    for size in sizes:
+        data = clustered_samples(size, dim=dim, how_many_clusters=size // 10)
+        lsh = LocalitySensitiveHashing.from_array(data, r=1, b=1, expected_num_of_clusters=5)
+        # groups of 1 to 6 samples, ids in a random order, like the stragglers left by coalescence
+        order = numpy.random.RandomState(size).permutation(size)
+        bounds = numpy.cumsum(numpy.random.RandomState(size + 1).randint(1, 7, size=size))
+        bounds = numpy.concatenate(([0], bounds[bounds < size], [size]))
+        groups = [set(order[start:end].tolist()) for start, end in zip(bounds[:-1], bounds[1:])]
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.time()
+            (merged, merged_peak) = peak_memory(
+                lsh.merge_similarity_groups_with_l2norm_set_based, [set(group) for group in groups])
+            merged_time = time.time() - start
+            if size <= legacy_limit:
+                start = time.time()
+                (legacy, legacy_peak) = peak_memory(legacy_l2norm_set_based, lsh, groups, 5)
+                legacy_time = time.time() - start
+        if size <= legacy_limit:
+            print("  %6d samples, %6d groups: %7.3f s, %6.1f MB peak per pair; %7.3f s, %6.1f MB peak with ids;"
+                  " same groups: %s" % (size, len(groups), legacy_time, legacy_peak, merged_time, merged_peak,
+                                        legacy == merged))
+        else:
+            print("  %6d samples, %6d groups: %7.3f s, %6.1f MB peak with ids"
+                  % (size, len(groups), merged_time, merged_peak))
+
+
+def legacy_neighborhood_clusters(lsh):
+    """The dict of sets that lsh_basic_for_neighborhood_clusters() used to build, one set per sample"""
+    similarity_neighborhoods = {sample_id: set() for sample_id in range(len(lsh._sample_names))}
+    for key in lsh.band_hash:
+        for sample_id in lsh.band_hash[key]:
+            similarity_neighborhoods[sample_id].update(lsh.band_hash[key] - set([sample_id]))
+    similarity_groups = []
+    for key in similarity_neighborhoods:
+        simgroup = set(similarity_neighborhoods[key])
+        simgroup.add(key)
+        similarity_groups.append(simgroup)
+    return similarity_groups
+
+
+def bench_neighborhoods(sizes=(2000, 5000, 10000), duplicate_fractions=(0.0, 0.2)):
+    """Neighborhoods as a dict of sets vs a CSR adjacency, with and without one large bucket of repeated samples"""
+    print("Similarity neighborhoods: dict of sets vs CSR adjacency")
+    for size, duplicate_fraction in itertools.product(sizes, duplicate_fractions):
+        data = clustered_samples(size, how_many_clusters=size // 10)
+        # retweets and boilerplate tweets: many copies of one sample that land in one bucket in every band
+        data[:int(size * duplicate_fraction)] = data[0]
+        lsh = hashed_lsh(data, r=16, b=20)
+        lsh._band_hash_all_data()
+
+        start = time.time()
+        legacy, legacy_peak = peak_memory(legacy_neighborhood_clusters, lsh)
+        legacy_time = time.time() - start
+
+        start = time.time()
+        adjacency, adjacency_peak = peak_memory(lsh.lsh_basic_for_neighborhood_adjacency)
+        adjacency_time = time.time() - start
+
+        from ELocalitySensitiveHashing import NeighborhoodGroups
+        same = list(NeighborhoodGroups(adjacency)) == legacy
+        print("  %5d samples, %2d%% identical, %8d pairs: %7.3f s, %7.1f MB peak as sets; %7.3f s, %6.1f MB peak as CSR; "
+              "same groups: %s" % (size, 100 * duplicate_fraction, adjacency.nnz, legacy_time, legacy_peak, adjacency_time,
+                                   adjacency_peak, same))
+
+
+def bench_bucket_cap(size=10000, max_bucket_size=100, duplicate_fraction=0.2, near_duplicate_fraction=0.1):
+    """Band hashing with and without a bucket cap, on data with a block of identical and a block of near-identical samples"""
+    print("Bucket cap of %d: %d samples, %d%% identical, %d%% near-identical"
+          % (max_bucket_size, size, 100 * duplicate_fraction, 100 * near_duplicate_fraction))
+    data = clustered_samples(size, how_many_clusters=size // 10)
+    duplicates, near_duplicates = int(size * duplicate_fraction), int(size * near_duplicate_fraction)
+    data[:duplicates] = data[0]
+    noise = numpy.random.RandomState(1).normal(scale=0.01, size=(near_duplicates, data.shape[1]))
+    data[duplicates:duplicates + near_duplicates] = data[duplicates] + noise
+    reference = None
+    for options in ({}, {'oversized_bucket_strategy': 'collapse'}, {'oversized_bucket_strategy': 'split'}):
+        lsh = LocalitySensitiveHashing.from_array(data, r=16, b=20, expected_num_of_clusters=5,
+                                                  max_bucket_size=max_bucket_size if options else None, **options)
+        numpy.random.seed(0)
+        lsh.initialize_hash_store()
+        lsh.hash_all_data()
+        start = time.time()
+        lsh.lsh_basic_for_neighborhood_clusters()
+        groups = set(map(frozenset, lsh.merge_similarity_groups_with_union_find()))
+        elapsed = time.time() - start
+        reference = groups if reference is None else reference
+        stats = lsh.bucket_stats
+        print("  %-9s: %7.3f s, largest bucket %5d, %9d candidate pairs (%9d avoided), %5d collapsed, "
+              "%4d still oversized, %6d CSR pairs, same union-find groups: %s"
+              % (options.get('oversized_bucket_strategy', 'no cap'), elapsed, stats['largest_bucket_after'],
+                 stats['candidate_pairs_after'], stats['candidate_pairs_avoided'], stats['collapsed_samples'],
+                 stats['still_oversized_buckets'], lsh.similarity_neighborhoods.nnz, groups == reference))
+
+
+def bench_dedup(size=None, num_perm=512):
+    """
+    Duplicate collapse of ds.csv: the weighted results of lsHash.py's stages
+    against those of the full corpus, asserted equal, and the time it saves
+    """
+    from sklearn.cluster import DBSCAN
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from hashedFeatures import weighted_tfidf
+    from lsHash import cluster_rows, largest_cluster, similar_tweets
+    from tweetDedup import collapse_duplicates
+    from tweetStream import ngram_shingles
+    tweets = load_tweets(size)
+    start = time.time()
+    distinct, weights = collapse_duplicates(tweets)
+    elapsed = time.time() - start
+    documents = [tweets[i] for i in distinct]
+    print("Duplicate collapse of %d tweets of ds.csv: %d distinct, %.1f%% collapsed in %.3f s"
+          % (len(tweets), len(documents), 100.0 * (len(tweets) - len(documents)) / len(tweets), elapsed))
+    # every tweet as the distinct document it was collapsed into
+    first = dict((document, j) for j, document in enumerate(documents))
+    copy_of = numpy.array([first[tweet] for tweet in tweets])
+    full = TfidfVectorizer(ngram_range=(2, 2)).fit_transform(tweets)
+    weighted = weighted_tfidf(documents, weights)
+    difference = abs(full[distinct] - weighted).max()
+    print("  weighted TF-IDF, largest difference to the full corpus rows: %.2e" % difference)
+    assert difference < 1e-12, "the weighted TF-IDF differs from the full corpus rows"
+    words = ngram_shingles(tweets, [1])[1]
+    counted = {}
+    for j, document_words in enumerate(ngram_shingles(documents, [1])[1]):
+        for word in document_words:
+            counted[word] = counted.get(word, 0) + int(weights[j])
+    full_counts = dict(zip(*numpy.unique(list(itertools.chain.from_iterable(words)), return_counts=True)))
+    assert counted == full_counts, "the weighted word counts differ from the full counts"
+    points = numpy.random.RandomState(0).normal(size=(len(documents), 2))
+    full_labels = DBSCAN(eps=0.1, min_samples=3).fit_predict(points[copy_of])
+    weighted_labels = DBSCAN(eps=0.1, min_samples=3).fit_predict(points, sample_weight=weights)
+    assert numpy.array_equal(full_labels, weighted_labels[copy_of]), "DBSCAN labels the copies apart"
+    runs = {
+        "full": (tweets, numpy.ones(len(tweets), dtype=numpy.int64), numpy.arange(len(tweets)),
+                 numpy.arange(len(tweets)), full),
+        "collapsed": (documents, weights, numpy.array(distinct), copy_of, weighted),
+    }
+    sizes, chosen, top_words = {}, {}, {}
+    for label, (corpus, corpus_weights, first_seen, stream, features) in runs.items():
+        start = time.time()
+        lsh = LocalitySensitiveHashing.from_array(tweet_signatures(corpus, num_perm), weights=corpus_weights,
+                                                  r=50, b=100, expected_num_of_clusters=5)
+        numpy.random.seed(0)
+        lsh.initialize_hash_store()
+        lsh.hash_all_data()
+        similarity_groups = lsh.lsh_basic_for_neighborhood_clusters()
+        groups = lsh.merge_similarity_groups_with_coalescence(similarity_groups[i] for i in stream.tolist())
+        sizes[label] = sorted(lsh.group_weight(group) for group in groups)
+        lsh_time = time.time() - start
+        # the all-pairs verification and DBSCAN stages of lsHash.py
+        start = time.time()
+        chosen[label] = similar_tweets(groups, corpus, corpus_weights)
+        rows = features[chosen[label]]
+        row_weights = corpus_weights[chosen[label]]
+        _, labels = cluster_rows(rows, row_weights)
+        cluster, _ = largest_cluster(labels, row_weights, first_seen[chosen[label]])
+        top_words[label] = Counter()
+        for doc_num, cluster_label in zip(chosen[label], labels):
+            if cluster_label == cluster:
+                for word in ngram_shingles([corpus[doc_num]], [1])[1][0]:
+                    top_words[label][word] += int(corpus_weights[doc_num])
+        print("  %-9s: MinHash + LSH + coalescence %7.3f s, %d groups, largest stands for %d tweets; "
+              "%d DBSCAN rows standing for %d tweets, %.3f s, top words %s"
+              % (label, lsh_time, len(groups), sizes[label][-1], rows.shape[0], row_weights.sum(),
+                 time.time() - start, top_words[label].most_common(2)))
+    assert sizes['collapsed'] == sizes['full'], "the group weights differ from the full group sizes"
+    # the tweets chosen for DBSCAN, each as its distinct document and number of copies
+    assert (Counter(copy_of[chosen['full']].tolist()) ==
+            dict(zip(chosen['collapsed'], weights[chosen['collapsed']].tolist()))), "DBSCAN sees other tweets"
+    assert top_words['collapsed'] == top_words['full'], "the DBSCAN trending-word counts differ"
+    print("  group sizes, DBSCAN rows and DBSCAN word counts of the collapsed run equal those of the full run")
+
+
+def bench_csv_loading(how_many=20000, dim=128):
+    print("CSV loading: %d samples x %d values" % (how_many, dim))
+    handle, datafile = tempfile.mkstemp(suffix='.csv')
+    os.close(handle)
+    try:
+        write_samples_to_csv(clustered_samples(how_many, dim=dim), datafile)
+        for cleanup in (False, True):
+            start = time.time()
+            legacy_csv_parse(datafile, cleanup)
+            legacy_time = time.time() - start
+            for dtype in (numpy.float64, numpy.float32):
+                lsh = LocalitySensitiveHashing(datafile=datafile, dim=dim, r=1, b=1, csv_cleanup_needed=cleanup)
+                lsh.get_data_from_csv(dtype=dtype)
+                print("  cleanup=%-5s %-7s: %7.3f s per-line, %7.3f s chunked (%.1f MB/s)"
+                      % (cleanup, numpy.dtype(dtype).name, legacy_time, lsh.load_stats['seconds'],
+                         lsh.load_stats['megabytes_per_second']))
+    finally:
+        os.remove(datafile)
+
+
+def tfidf_features(tweets, dense):
+    """The TF-IDF, feature row selection and 2D reduction steps of lsHash.py"""
+    from sklearn.decomposition import PCA
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    XA = TfidfVectorizer(ngram_range=(2, 2)).fit_transform(tweets)
+    rows = list(range(0, XA.shape[0], 2))
+    if dense:
+        XA = XA.toarray()
+        return PCA(n_components=2).fit_transform([XA[d] for d in rows])
+    return PCA(n_components=2, svd_solver='arpack').fit_transform(XA[rows])
+
+
+def dbscan_labels(points):
+    """The scaling and DBSCAN steps of lsHash.py"""
+    from sklearn.cluster import DBSCAN
+    from sklearn.preprocessing import StandardScaler
+    return DBSCAN(eps=0.5, min_samples=2).fit_predict(StandardScaler().fit_transform(points))
+
+
+def bench_tfidf_memory(sizes=(2000, 5000, 20000), dense_limit_mb=4096):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    print("TF-IDF path peak memory: dense .toarray() + PCA vs sparse CSR + arpack PCA")
+    for size in sizes:
+        tweets = load_tweets(size)
+        vocabulary_size = len(TfidfVectorizer(ngram_range=(2, 2)).fit(tweets).vocabulary_)
+        dense_mb = size * vocabulary_size * 8 / 2.0**20
+        sparse_2d, sparse_peak = peak_memory(tfidf_features, tweets, False)
+        if dense_mb <= dense_limit_mb:
+            dense_2d, dense_peak = peak_memory(tfidf_features, tweets, True)
+            dense_result = "%9.1f MB, projections differ by at most %.1e, same DBSCAN clusters: %s" % (
+                dense_peak, numpy.abs(sparse_2d - dense_2d).max(),
+                numpy.array_equal(dbscan_labels(sparse_2d), dbscan_labels(dense_2d)))
+        else:
+            dense_result = "not run (the dense matrix alone is %.0f MB)" % dense_mb
+        print("  %5d tweets, %6d bigrams: sparse %7.1f MB, dense %s"
+              % (size, vocabulary_size, sparse_peak, dense_result))
+
+
+def datasketch_minhash(num_perm, seed):
+    from datasketch import MinHash
+    try:
+        return MinHash(num_perm=num_perm, seed=seed, scheme='legacy')
+    except TypeError:
+        # datasketch before 2.0 only has the legacy scheme
+        return MinHash(num_perm=num_perm, seed=seed)
+
+
+def bench_minhash(size=2000, seed=3):
+    """Parity of the batched MinHash with datasketch, and the time taken by each"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from batchMinHash import feature_hashes, minhash_signatures
+    print("MinHash: per-document datasketch vs batched over CSR rows (%d tweets)" % size)
+    bag_of_words = TfidfVectorizer(ngram_range=(2, 2))
+    XA = bag_of_words.fit_transform(load_tweets(size))
+    names = bag_of_words.get_feature_names_out()
+    hashes = feature_hashes(names)
+    for num_perm in (64, 128, 256, 512):
+        start = time.time()
+        reference = []
+        for index in range(XA.shape[0]):
+            mhash = datasketch_minhash(num_perm, seed)
+            for column in XA[index].indices:
+                mhash.update(names[column].encode('utf8'))
+            reference.append(mhash.hashvalues)
+        per_document_time = time.time() - start
+
+        start = time.time()
+        signatures = minhash_signatures(XA, num_perm=num_perm, seed=seed, hashes=hashes)
+        batched_time = time.time() - start
+
+        mismatches = int((signatures != numpy.array(reference, dtype=numpy.uint64)).any(axis=1).sum())
+        print("  %3d perms: %7.3f s per-document, %7.3f s batched, %d of %d signatures differ"
+              % (num_perm, per_document_time, batched_time, mismatches, XA.shape[0]))
+        assert mismatches == 0, "the batched MinHash differs from datasketch"
+
+
+def check_minhash_parity(size=300, seeds=(1, 3, 42), perm_sizes=(1, 16, 64, 128, 256, 512)):
+    """
+    Assert that the batched MinHash signatures, their prefix views and the
+    signatures hashed in small blocks all equal those of datasketch
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from batchMinHash import feature_hashes, minhash_signatures, multi_resolution_signatures
+    # an empty row keeps the initial hash values
+    tweets = load_tweets(size) + [""]
+    bag_of_words = TfidfVectorizer(ngram_range=(2, 2))
+    XA = bag_of_words.fit_transform(tweets)
+    names = bag_of_words.get_feature_names_out()
+    hashes = feature_hashes(names)
+    print("MinHash parity with datasketch: %d tweets, seeds %s, %s perms"
+          % (XA.shape[0], list(seeds), list(perm_sizes)))
+    for seed in seeds:
+        views = multi_resolution_signatures(XA, perm_sizes, seed=seed, hashes=hashes)
+        for num_perm in perm_sizes:
+            reference = []
+            for index in range(XA.shape[0]):
+                mhash = datasketch_minhash(num_perm, seed)
+                for column in XA[index].indices:
+                    mhash.update(names[column].encode('utf8'))
+                reference.append(mhash.hashvalues)
+            reference = numpy.array(reference, dtype=numpy.uint64)
+            for label, signatures in (
+                    ("batched", minhash_signatures(XA, num_perm=num_perm, seed=seed, hashes=hashes)),
+                    ("prefix view", views[num_perm]),
+                    ("small blocks", minhash_signatures(XA, num_perm=num_perm, seed=seed, hashes=hashes,
+                                                        block_size=1024))):
+                assert numpy.array_equal(signatures, reference), \
+                    "%s signatures differ from datasketch at seed %d, %d perms" % (label, seed, num_perm)
+    print("  batched, prefix view and small-block signatures all equal datasketch's")
+
+
+def bench_multires(size=5000, seed=3, perm_sizes=(64, 128, 256, 512)):
+    """One max-size MinHash with prefix views vs a separate MinHash per size"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from batchMinHash import feature_hashes, minhash_signatures, multi_resolution_signatures
+    print("MinHash sweep over %s perms: per-size vs multi-resolution (%d tweets)" % (list(perm_sizes), size))
+    bag_of_words = TfidfVectorizer(ngram_range=(2, 2))
+    XA = bag_of_words.fit_transform(load_tweets(size))
+    hashes = feature_hashes(bag_of_words.get_feature_names_out())
+
+    start = time.time()
+    per_size = dict((num_perm, minhash_signatures(XA, num_perm=num_perm, seed=seed, hashes=hashes))
+                    for num_perm in perm_sizes)
+    per_size_time = time.time() - start
+
+    start = time.time()
+    views = multi_resolution_signatures(XA, perm_sizes, seed=seed, hashes=hashes)
+    multires_time = time.time() - start
+
+    same = all(numpy.array_equal(per_size[num_perm], views[num_perm]) for num_perm in perm_sizes)
+    print("  %7.3f s per-size, %7.3f s multi-resolution (%.1fx), identical signatures: %s"
+          % (per_size_time, multires_time, per_size_time / multires_time, same))
+
+
+def per_item_latency(function, items):
+    """Return the results of function over items and the time taken by each call in seconds"""
+    results = []
+    latencies = numpy.empty(len(items))
+    for index, item in enumerate(items):
+        start = time.perf_counter()
+        results.append(function(item))
+        latencies[index] = time.perf_counter() - start
+    return results, latencies
+
+
+def bench_normalizer(size=2000):
+    """Per-tweet latency of the original normalize() chain and of TweetNormalizer"""
+    from tweetPreprocessing import TweetNormalizer, legacy_preprocess
+    print("Tweet normalization: original chain vs TweetNormalizer (%d tweets)" % size)
+    tweets = load_tweets(size)
+    normalizer = TweetNormalizer()
+    # the first calls load the corpora; keep them out of the timings
+    legacy_preprocess(tweets[0])
+    normalizer(tweets[0])
+    for name, function in (('chain', legacy_preprocess), ('TweetNormalizer', normalizer)):
+        results, latencies = per_item_latency(function, tweets)
+        if name == 'chain':
+            reference = results
+        mismatches = sum(result != expected for result, expected in zip(results, reference))
+        print("  %-15s: mean %8.1f us, median %8.1f us, p99 %8.1f us per tweet, %d tweets differ"
+              % (name, 1e6 * latencies.mean(), 1e6 * numpy.median(latencies),
+                 1e6 * numpy.percentile(latencies, 99), mismatches))
+
+
+def bench_token_cache(maxsize=2**17):
+    """Hit rate of a TokenCache in front of lemmatization over all of ds.csv"""
+    from tokenCache import TokenCache
+    from tweetPreprocessing import TweetNormalizer
+    tweets = load_tweets()
+    print("Token cache: lemmatization over ds.csv (%d tweets), maxsize %d" % (len(tweets), maxsize))
+    for cache in (None, TokenCache(maxsize)):
+        normalizer = TweetNormalizer(cache=cache)
+        start = time.time()
+        for tweet in tweets:
+            normalizer(tweet)
+        elapsed = time.time() - start
+        if cache is None:
+            print("  uncached: %7.3f s" % elapsed)
+        else:
+            print("  cached  : %7.3f s, %s, hit rate %.1f%% (target: above 90%%)"
+                  % (elapsed, cache.cache_info(), 100 * cache.hit_rate()))
+
+
+def bench_parallel_preprocessing(worker_counts=(1, 2, 4, 8, 16), start_methods=('spawn', 'forkserver')):
+    """
+    Wall time of preprocess_tweets() over ds.csv for each number of worker
+    processes, and with two workers started by each of start_methods
+    """
+    from tweetPreprocessing import preprocess_tweets
+    tweets = load_tweets()
+    print("Parallel preprocessing of ds.csv (%d tweets, %d CPUs)" % (len(tweets), os.cpu_count()))
+    for workers in worker_counts:
+        start = time.time()
+        # the documents and word lists, without the per-worker cache statistics
+        result = preprocess_tweets(tweets, workers=workers)[:2]
+        elapsed = time.time() - start
+        if workers == worker_counts[0]:
+            reference, reference_time = result, elapsed
+        speedup = reference_time / elapsed
+        print("  %2d workers: %7.3f s, speedup %5.2fx, efficiency %5.1f%%, same output: %s"
+              % (workers, elapsed, speedup, 100 * speedup * worker_counts[0] / workers, result == reference))
+    for start_method in start_methods:
+        start = time.time()
+        result = preprocess_tweets(tweets, workers=2, start_method=start_method)[:2]
+        print("   2 workers, %-10s: %7.3f s, same output: %s" % (start_method, time.time() - start, result == reference))
+
+
+def bench_preprocessing_cache(size=None, new_fraction=0.1):
+    """Cold and warm runs of preprocess_tweets() with an on-disk cache, and a warm run with some new tweets"""
+    import shutil
+    from tweetPreprocessing import preprocess_tweets
+    tweets = load_tweets(size)
+    seen = int(len(tweets) * (1 - new_fraction))
+    print("Preprocessing cache over %d tweets of ds.csv" % len(tweets))
+    cold_dir, partial_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+    try:
+        start = time.time()
+        reference = preprocess_tweets(tweets, pos_tags=True)[:3]
+        print("  no cache      : %7.3f s" % (time.time() - start))
+        preprocess_tweets(tweets[:seen], pos_tags=True, cache_dir=partial_dir)
+        runs = (("cold", cold_dir), ("warm", cold_dir), ("%d%% new tweets" % (100 * new_fraction), partial_dir))
+        wall_times = {}
+        for label, cache_dir in runs:
+            start = time.time()
+            result = preprocess_tweets(tweets, pos_tags=True, cache_dir=cache_dir)[:3]
+            wall_times[label] = time.time() - start
+            print("  %-14s: %7.3f s, same output: %s" % (label, wall_times[label], result == reference))
+        print("  cold vs warm  : %7.3f s cold, %7.3f s warm wall clock (%.1fx)"
+              % (wall_times['cold'], wall_times['warm'], wall_times['cold'] / wall_times['warm']))
+    finally:
+        shutil.rmtree(cold_dir)
+        shutil.rmtree(partial_dir)
+
+
+def streamed_signatures(limit, chunk_size, signature_file, num_perm=128):
+    """Read, preprocess and MinHash the first limit tweets of ds.csv into a signature store, chunk by chunk"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from signatureStore import write_signature_blocks
+    from tweetPreprocessing import preprocess_tweet_chunks
+    from tweetStream import read_tweet_chunks, stream_minhash_signatures
+    chunks = read_tweet_chunks('ds.csv', chunk_size=chunk_size, limit=limit)
+    documents = (preprocessed.documents for preprocessed in preprocess_tweet_chunks(chunks))
+    analyzer = TfidfVectorizer(ngram_range=(2, 2)).build_analyzer()
+    blocks = stream_minhash_signatures(documents, analyzer, num_perm=num_perm, seed=3)
+    return write_signature_blocks(signature_file, blocks, seed=3, num_perm=num_perm)
+
+
+def bench_streaming(limits=(5000, 10000, 20000), chunk_size=1000):
+    """Peak memory of the streaming ingestion pipeline as the number of tweets grows"""
+    print("Streaming ingestion of ds.csv in chunks of %d tweets into a signature store" % chunk_size)
+    handle, signature_file = tempfile.mkstemp(suffix='.sig')
+    os.close(handle)
+    try:
+        for limit in limits:
+            start = time.time()
+            header, peak = peak_memory(streamed_signatures, limit, chunk_size, signature_file)
+            print("  %5d tweets: %7.3f s, peak %6.1f MB" % (header['shape'][0], time.time() - start, peak))
+    finally:
+        os.remove(signature_file)
+
+
+def neighbor_overlap(A, B, queries, k=10):
+    """Mean fraction of the k nearest rows by cosine under A that are also among the k nearest under B"""
+    overlaps = []
+    for similarities_a, similarities_b in zip((A[queries] @ A.T).toarray(), (B[queries] @ B.T).toarray()):
+        nearest_a = set(numpy.argsort(-similarities_a, kind='stable')[1:k + 1])
+        nearest_b = set(numpy.argsort(-similarities_b, kind='stable')[1:k + 1])
+        overlaps.append(len(nearest_a & nearest_b) / float(k))
+    return numpy.mean(overlaps)
+
+
+def bench_hashing_features(size=None, chunk_size=2000, n_features_list=(2**16, 2**18, 2**20), how_many_queries=500):
+    """Hashed TF-IDF with a streamed IDF estimate against TfidfVectorizer bigrams on ds.csv"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from hashedFeatures import HashedTfidf
+    tweets = load_tweets(size)
+    print("Hashed bigram TF-IDF vs TfidfVectorizer(ngram_range=(2, 2)) on %d tweets of ds.csv" % len(tweets))
+    start = time.time()
+    bag_of_words = TfidfVectorizer(ngram_range=(2, 2))
+    exact = bag_of_words.fit_transform(tweets)
+    vocabulary_size = len(bag_of_words.vocabulary_)
+    print("  TfidfVectorizer: %7.3f s, %d bigrams in the vocabulary" % (time.time() - start, vocabulary_size))
+    queries = numpy.random.RandomState(0).choice(exact.shape[0], how_many_queries, replace=False)
+    exact_similarities = (exact[queries] @ exact.T).toarray()
+    for n_features in n_features_list:
+        hashed_tfidf = HashedTfidf(n_features=n_features)
+        start = time.time()
+        # the IDF as it stands after each chunk, as a stream would see it
+        online = [hashed_tfidf.partial_fit(tweets[i:i + chunk_size]).transform(tweets[i:i + chunk_size])
+                  for i in range(0, len(tweets), chunk_size)]
+        elapsed = time.time() - start
+        online = vstack(online).tocsr()
+        final = hashed_tfidf.transform(tweets)
+        bigram_buckets = hashed_tfidf.counts(bag_of_words.get_feature_names_out()).indices
+        # bigrams that land in a bucket some other bigram already holds
+        merged = len(bigram_buckets) - len(numpy.unique(bigram_buckets))
+        for label, features in (("streamed IDF", online), ("final IDF", final)):
+            error = numpy.abs((features[queries] @ features.T).toarray() - exact_similarities)
+            print("  %7d buckets, %-12s: %7.3f s, %5.1f%% of bigrams merged, cosine error mean %.4f max %.4f, "
+                  "top-10 neighbor overlap %.3f"
+                  % (n_features, label, elapsed, 100.0 * merged / vocabulary_size, error.mean(), error.max(),
+                     neighbor_overlap(exact, features, queries)))
+
+
+def bench_ngram_runs(size=5000, ngram_sizes=(1, 2, 3), num_perm=128):
+    """Unigram, bigram and trigram MinHash runs, each from scratch vs from one preprocessing and tokenization pass"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from tweetPreprocessing import preprocess_tweets
+    from tweetStream import stream_minhash_signatures, stream_ngram_minhash_signatures
+    tweets = load_tweets(size)
+    print("N-gram runs %s over %d tweets, %d perms" % (list(ngram_sizes), len(tweets), num_perm))
+
+    start = time.time()
+    separate = {}
+    for n in ngram_sizes:
+        documents = preprocess_tweets(tweets).documents
+        analyzer = TfidfVectorizer(ngram_range=(n, n)).build_analyzer()
+        separate[n] = next(stream_minhash_signatures([documents], analyzer, num_perm=num_perm, seed=3))
+    separate_time = time.time() - start
+
+    start = time.time()
+    documents = preprocess_tweets(tweets).documents
+    shared = next(stream_ngram_minhash_signatures([documents], ngram_sizes, num_perm=num_perm, seed=3))
+    shared_time = time.time() - start
+
+    same = all(numpy.array_equal(separate[n], shared[n]) for n in ngram_sizes)
+    print("  %7.3f s one pipeline per n-gram size, %7.3f s shared pass (%.1fx), identical signatures: %s"
+          % (separate_time, shared_time, separate_time / shared_time, same))
+
+
+def bench_tokenizer(examples=5):
+    """Parity after normalization and tokens per second of word_tokenize and the regex tokenizer over ds.csv"""
+    from tweetPreprocessing import TweetNormalizer, load_tokenizer, regex_tokenize
+    tweets = load_tweets()
+    print("Tokenizers over ds.csv (%d tweets)" % len(tweets))
+    treebank, regex = TweetNormalizer(tokenizer='treebank'), TweetNormalizer(tokenizer='regex')
+    cleaned = [treebank.clean(tweet) for tweet in tweets]
+    for name in ('treebank', 'regex'):
+        tokenize = load_tokenizer(name)
+        start = time.time()
+        how_many_tokens = sum(len(tokenize(tweet)) for tweet in cleaned)
+        elapsed = time.time() - start
+        print("  %-8s: %7.3f s, %8d tokens, %10.0f tokens/s" % (name, elapsed, how_many_tokens, how_many_tokens / elapsed))
+    differing = [(tweet, expected, words) for tweet, expected, words in
+                 zip(cleaned, map(treebank.normalize_words, map(load_tokenizer('treebank'), cleaned)),
+                     map(regex.normalize_words, map(regex_tokenize, cleaned)))
+                 if words != expected]
+    print("  normalized words differ for %d of %d tweets (%.2f%%)"
+          % (len(differing), len(tweets), 100.0 * len(differing) / len(tweets)))
+    for tweet, expected, words in differing[:examples]:
+        print("    %r\n      treebank only: %s\n      regex only   : %s"
+              % (tweet[:100], [word for word in expected if word not in words],
+                 [word for word in words if word not in expected]))
+
+
+# Import time allowed for the lsHash.py entry point, which should only import the standard library
+import_budget_ms = 50
+
+
+def import_time_ms(module, repeats=3):
+    """Best cumulative import time of module in a fresh interpreter, from python -X importtime"""
+    import subprocess
+    best = None
+    for _ in range(repeats):
+        stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+        for line in stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module and fields[2].startswith(' ' + module):
+                cumulative = int(fields[1]) / 1000.0
+                best = cumulative if best is None else min(best, cumulative)
+    return best
+
+
+def bench_import_time(modules=('lsHash', 'ELocalitySensitiveHashing', 'tweetPreprocessing', 'tweetStream',
+                               'hashedFeatures', 'signatureStore')):
+    """python -X importtime of the entry point and the pipeline modules, against import_budget_ms"""
+    print("Import time (cumulative, best of 3)")
+    for module in modules:
+        print("  %-26s: %8.1f ms" % (module, import_time_ms(module)))
+    elapsed = import_time_ms('lsHash')
+    print("  import lsHash %s the %d ms budget" % ("is within" if elapsed <= import_budget_ms else "EXCEEDS",
+                                                   import_budget_ms))
+
+
+benchmarks = {
+    'bucket_cap': bench_bucket_cap,
+    'coalescence': bench_coalescence,
+    'csv_loading': bench_csv_loading,
+    'dedup': bench_dedup,
+    'hashing_features': bench_hashing_features,
+    'import_time': bench_import_time,
+    'l2norm_merge': bench_l2norm_merge,
+    'minhash': bench_minhash,
+    'minhash_parity': check_minhash_parity,
+    'multires': bench_multires,
+    'neighborhoods': bench_neighborhoods,
+    'ngram_runs': bench_ngram_runs,
+    'normalizer': bench_normalizer,
+    'parallel_preprocessing': bench_parallel_preprocessing,
+    'preprocessing_cache': bench_preprocessing_cache,
+    'set_merge': bench_set_merge,
+    'streaming': bench_streaming,
+    'token_cache': bench_token_cache,
+    'tokenizer': bench_tokenizer,
+    'tfidf_memory': bench_tfidf_memory,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or sorted(benchmarks):
+        benchmarks[name]()
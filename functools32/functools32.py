@@ -12,14 +12,21 @@ __all__ = ['update_wrapper', 'wraps', 'WRAPPER_ASSIGNMENTS', 'WRAPPER_UPDATES',
            'total_ordering', 'cmp_to_key', 'lru_cache', 'reduce', 'partial']
 
 from _functools import partial, reduce
-from collections import MutableMapping, namedtuple
+from collections import namedtuple
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 from .reprlib32 import recursive_repr as _recursive_repr
 from weakref import proxy as _proxy
 import sys as _sys
 try:
     from thread import allocate_lock as Lock
 except ImportError:
-    from ._dummy_thread32 import allocate_lock as Lock
+    try:
+        from _thread import allocate_lock as Lock
+    except ImportError:
+        from ._dummy_thread32 import allocate_lock as Lock
 
 ################################################################################
 ### OrderedDict
@@ -2,12 +2,18 @@
 
 __all__ = ["Repr", "repr", "recursive_repr"]
 
-import __builtin__ as builtins
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
 from itertools import islice
 try:
     from thread import get_ident
 except ImportError:
-    from _dummy_thread32 import get_ident
+    try:
+        from _thread import get_ident
+    except ImportError:
+        from ._dummy_thread32 import get_ident
 
 def recursive_repr(fillvalue='...'):
     'Decorator to make a repr function return fillvalue for a recursive call'
@@ -0,0 +1,127 @@
+'''
+Stateless n-gram featurization by feature hashing, for streams of tweets.
+
+TfidfVectorizer has to see the whole corpus to build its vocabulary before
+it can vectorize anything.  Here every n-gram is hashed straight into one of
+a fixed number of buckets with scikit-learn's HashingVectorizer, so any
+batch of documents can be vectorized, and MinHashed, on its own, in any
+process and in any order.  HashedTfidf adds an inverse document frequency
+estimated from the batches seen so far: the document frequency of every
+bucket is a plain count, so the counts of batches processed apart can be
+summed.  The IDF and the normalization follow TfidfVectorizer's defaults
+(smooth_idf=True, norm='l2'), so once every document has been counted the
+features equal those of TfidfVectorizer up to bucket collisions.
+
+Document frequencies can be weighted, so that a document that stands for
+several identical ones, e.g. after duplicate tweets are collapsed, counts
+as that many documents in the IDF; weighted_tfidf() does the same for the
+exact n-gram vocabulary of TfidfVectorizer.
+'''
+import numpy
+
+from batchMinHash import minhash_signatures
+
+
+def preshingled(shingles):
+    """Analyzer for documents that are already lists of shingles, e.g. from tweetStream.ngram_shingles()"""
+    return shingles
+
+
+def hashing_vectorizer(n_features=2**20, ngram_range=(2, 2), analyzer='word'):
+    """Raw n-gram counts in n_features buckets, tokenized the way TfidfVectorizer tokenizes"""
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer(n_features=n_features, ngram_range=ngram_range, analyzer=analyzer,
+                             alternate_sign=False, norm=None)
+
+
+def document_frequencies(X, weights=None):
+    """The number of rows of the count matrix X in which every bucket occurs, row i counting weights[i] times"""
+    X = X.tocsr()
+    X.sum_duplicates()
+    if weights is None:
+        return numpy.bincount(X.indices, minlength=X.shape[1])
+    row_weights = numpy.repeat(numpy.asarray(weights, dtype=numpy.float64), numpy.diff(X.indptr))
+    return numpy.bincount(X.indices, weights=row_weights, minlength=X.shape[1]).astype(numpy.int64)
+
+
+def smooth_idf(document_frequency, n_documents):
+    """TfidfVectorizer's IDF with smooth_idf=True"""
+    return numpy.log((1.0 + n_documents) / (1.0 + document_frequency)) + 1.0
+
+
+def tfidf(X, idf):
+    """L2-normalized TF-IDF rows of the count matrix X"""
+    from sklearn.preprocessing import normalize
+    X = X.astype(numpy.float64)
+    X.data *= idf[X.indices]
+    return normalize(X, norm='l2', copy=False)
+
+
+def weighted_tfidf(documents, weights, ngram_range=(2, 2)):
+    """
+    The rows of documents in TfidfVectorizer(ngram_range=ngram_range).fit_transform()
+    of a corpus in which document i occurs weights[i] times, computed from one
+    copy of each: the IDF is that of the whole corpus.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+    X = CountVectorizer(ngram_range=ngram_range).fit_transform(documents)
+    return tfidf(X, smooth_idf(document_frequencies(X, weights), numpy.sum(weights)))
+
+
+def hashed_minhash_signatures(documents, num_perm=128, seed=1, n_features=2**20, ngram_range=(2, 2)):
+    """
+    MinHash signatures of the sets of hashed n-gram buckets of documents.
+    Nothing is shared between calls, so batches can be signed in parallel.
+    The bucket numbers are distinct integers below 2**32 and serve directly as
+    the feature hashes.
+    """
+    X = hashing_vectorizer(n_features, ngram_range).transform(documents)
+    return minhash_signatures(X, num_perm=num_perm, seed=seed,
+                              hashes=numpy.arange(n_features, dtype=numpy.uint64))
+
+
+class HashedTfidf(object):
+    '''
+    TF-IDF over n_features hashed n-gram buckets, with the IDF estimated from
+    the documents passed to partial_fit() so far.  With analyzer=preshingled
+    the documents are lists of shingles instead of text.
+    '''
+
+    def __init__(self, n_features=2**20, ngram_range=(2, 2), analyzer='word'):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.vectorizer = hashing_vectorizer(n_features, ngram_range, analyzer)
+        self.document_frequency = numpy.zeros(n_features, dtype=numpy.int64)
+        self.n_documents = 0
+
+    def counts(self, documents):
+        return self.vectorizer.transform(documents)
+
+    def add_document_frequencies(self, frequencies, n_documents):
+        """Fold in the document_frequencies() of a batch counted elsewhere"""
+        self.document_frequency += frequencies
+        self.n_documents += n_documents
+
+    def partial_fit(self, documents):
+        X = self.counts(documents)
+        self.add_document_frequencies(document_frequencies(X), X.shape[0])
+        return self
+
+    def idf(self):
+        return smooth_idf(self.document_frequency, self.n_documents)
+
+    def transform(self, documents):
+        """L2-normalized TF-IDF rows of documents under the current IDF estimate"""
+        return tfidf(self.counts(documents), self.idf())
+
+    def partial_fit_minhash(self, documents, num_perm=128, seed=1):
+        """Count a batch into the IDF estimate and return its MinHash signatures"""
+        X = self.counts(documents)
+        self.add_document_frequencies(document_frequencies(X), X.shape[0])
+        return minhash_signatures(X, num_perm=num_perm, seed=seed,
+                                  hashes=numpy.arange(self.n_features, dtype=numpy.uint64))
+
+    def stream_minhash_signatures(self, document_chunks, num_perm=128, seed=1):
+        """Generator of the MinHash signature block of each chunk, updating the IDF along the way"""
+        for documents in document_chunks:
+            yield self.partial_fit_minhash(documents, num_perm=num_perm, seed=seed)
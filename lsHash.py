@@ -1,40 +1,71 @@
-from nltk.stem import LancasterStemmer, WordNetLemmatizer
-import inflect
-import unicodedata
-import string
-import pylab
-import plotly.graph_objs as go
-import plotly.plotly as py
-import numpy as np
-from datasketch import MinHash, MinHashLSH
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.feature_extraction.text import CountVectorizer
-from nltk.util import ngrams
-import sys
-from nltk.corpus import stopwords
-from ELocalitySensitiveHashing import *
+'''
+Trending topics of the tweets in ds.csv: MinHash LSH buckets of similar
+tweets, refined with DBSCAN, and the most common nouns of the largest group.
+
+Run it with python lsHash.py, or import it and call main() after changing
+any of the settings below.  Importing it has no side effects.
+'''
 import itertools
-from collections import Counter
-from statistics import mode
-from sklearn.decomposition import PCA
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import DBSCAN
-from SetSimilaritySearch import all_pairs
-# from LocalitySensitiveHashing import *
-import csv
-import pandas as pd
-from nltk.tokenize import word_tokenize
-import re
-from nltk import pos_tag, chunk
-import nltk
+import os
 import time
+from collections import Counter
 
 accepted_pos = ['NN', 'NNP', 'NNS', 'NNPS']
 
+# Set to a directory to keep the MinHash signatures in a binary signature
+# store there, and to hash them from disk through numpy.memmap.  A later run
+# with the same ds.csv and settings reopens the stores instead of MinHashing
+# the tweets again.
+signature_dir = None
+
+# Number of tweets of ds.csv to cluster; None for all of them.
+tweet_limit = 2000
+
+# Set to a number of tweets to stream ds.csv in chunks of that size instead of
+# loading it whole.  Only one chunk of raw tweets is in memory at a time, and
+# the bigrams are MinHashed without a corpus-wide vocabulary.
+stream_chunk_size = None
+
+# 'tfidf' for TfidfVectorizer bigrams over the whole corpus, or 'hashing' for
+# bigrams hashed into a fixed number of buckets with an IDF estimated as the
+# tweets stream in; the hashing mode needs no vocabulary.
+featurization = 'tfidf'
+
+# Word n-gram sizes to cluster on, e.g. [1, 2, 3] for the unigram, bigram and
+# trigram runs; all of them are cut from one tokenization of each tweet.
+ngram_sizes = [2]
+
+# Worker processes for preprocessing the tweets; None uses one per CPU.  Where
+# they are spawned rather than forked (Windows, macOS and the forkserver
+# default of newer Pythons) each worker imports the calling script again, so a
+# script that calls main() must do so under an if __name__ == '__main__': guard.
+preprocess_workers = None
+
+# 'treebank' to tokenize tweets with nltk's word_tokenize, or 'regex' for the
+# faster tweet tokenizer that keeps URLs, hashtags and mentions whole.
+tweet_tokenizer = 'treebank'
+
+# Set to a directory to keep the preprocessed tweets there between runs, so
+# that only tweets not seen before are normalized and tagged.
+preprocess_cache_dir = None
+
+# Set to cap the number of tweets in an LSH band bucket.  Larger buckets, e.g.
+# of the bot-generated weather tweets in ds.csv, are handled with the
+# oversized_bucket_strategy: 'collapse' keeps one of each set of tweets with
+# identical signatures, 'split' sub-buckets them by further bands and only
+# collapses the sets of identical signatures that are larger than the cap.
+max_bucket_size = None
+oversized_bucket_strategy = 'collapse'
+
+# Collapse tweets that are identical once normalized, e.g. retweets, into one
+# weighted document before MinHashing; the weights keep the cluster sizes,
+# DBSCAN densities and word counts those of the full stream.
+collapse_duplicate_tweets = True
+
 
 # custom functions
 def matplotlib_to_plotly(cmap, pl_entries):
+    import numpy as np
     h = 1.0/(pl_entries-1)
     pl_colorscale = []
 
@@ -45,409 +76,424 @@ def matplotlib_to_plotly(cmap, pl_entries):
     return pl_colorscale
 
 
-def remove_non_ascii(words):
-    """Remove non-ASCII characters from list of tokenized words"""
-    new_words = []
-    for word in words:
-        new_word = unicodedata.normalize('NFKD', word).encode(
-            'ascii', 'ignore').decode('utf-8', 'ignore')
-        new_words.append(new_word)
-    return new_words
-
-
-def to_lowercase(words):
-    """Convert all characters to lowercase from list of tokenized words"""
-    new_words = []
-    for word in words:
-        new_word = word.lower()
-        new_words.append(new_word)
-    return new_words
-
-
-def remove_punctuation(words):
-    """Remove punctuation from list of tokenized words"""
-    new_words = []
-    for word in words:
-        new_word = re.sub(r'[^\w\s]', '', word)
-        if new_word != '':
-            new_words.append(new_word)
-    return new_words
-
-
-def replace_numbers(words):
-    """Replace all interger occurrences in list of tokenized words with textual representation"""
-    p = inflect.engine()
-    new_words = []
-    for word in words:
-        if word.isdigit():
-            new_word = p.number_to_words(word)
-            new_words.append(new_word)
-        else:
-            new_words.append(word)
-    return new_words
-
-
-def remove_stopwords(words):
-    """Remove stop words from list of tokenized words"""
-    new_words = []
-    for word in words:
-        if word not in stopwords.words('english'):
-            new_words.append(word)
-    return new_words
-
-
-def stem_words(words):
-    """Stem words in list of tokenized words"""
-    stemmer = LancasterStemmer()
-    stems = []
-    for word in words:
-        stem = stemmer.stem(word)
-        stems.append(stem)
-    return stems
-
-
-def lemmatize_verbs(words):
-    """Lemmatize verbs in list of tokenized words"""
-    lemmatizer = WordNetLemmatizer()
-    lemmas = []
-    for word in words:
-        lemma = lemmatizer.lemmatize(word, pos='v')
-        lemmas.append(lemma)
-    return lemmas
-
-
-def normalize(words):
-    words = remove_non_ascii(words)
-    words = to_lowercase(words)
-    words = remove_punctuation(words)
-    # words = replace_numbers(words)
-    words = lemmatize_verbs(words)
-    words = remove_stopwords(words)
-    return words
-
-
-bag_of_words = TfidfVectorizer(ngram_range=(2, 2))
-# bag_of_words = CountVectorizer(ngram_range=(2, 2))
-
-# df = pd.read_csv('movie_reviews.csv')
-df = pd.read_csv('ds.csv')
-
-tweets_df = df.review[:2000]
-
-
-print("size of dataset : ", tweets_df.shape)
-processedTweets = []
-tokenizedTweets = []
-
-
-# print(" >>>>>>>>>>>>>>>>>> : Preprocessing Tweet")
-start = time.time()
-
-for index, tweet in enumerate(tweets_df):
-
-    tweet = re.sub(
-        r'(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:\'".,<>?«»“”‘’]))', '', tweet)
-
-    tweet = re.sub("&amp;", "", tweet)
-    tweet = re.sub("br", "", tweet)
-    words = word_tokenize(tweet)
-    words = normalize(words)
-
-    newDoc = ' '.join(words)
-
-    processedTweets.append(newDoc)
-
-    tokenizedTweets.append(words)
-
-dfNew = pd.DataFrame(columns=['review'], data=processedTweets)
-
-XA = bag_of_words.fit_transform(processedTweets).toarray()
-
-end = time.time()
-diff = end - start
-# print(diff, " : seconds ")
-# print(" >>>>>>>>>>>>>>>>>> : Min Hashing")
-
-
-permutation_list = [64, 128, 256, 512]
-for num_perms in permutation_list:
-
-    start = time.time()
-
-    minHashArray = []
-
-    for document in XA:
-        mhash = MinHash(num_perm=num_perms, seed=3)
-        mhash.update(document)
-        minHashArray.append(mhash.hashvalues)
-
-    exportedList = []
-    for index, arr in enumerate(minHashArray):
-        a = arr.tolist()
-        a.insert(0, "doc_"+str(index))
-        # a = np.insert(arr,  0, str(index) + "_doc", axis=0)
-        exportedList.append(a)
-
-    datafile = "csvfile.csv"
-
-    # Export list to csv file
-    with open(datafile, "w") as output:
-        writer = csv.writer(output, lineterminator='\n')
-        writer.writerows(exportedList)
-
-    end = time.time()
-    diff = end - start
-    # print(diff, " : seconds ")
-
-    print(" >>>>>>>>>>>>>>>>>> : LSH")
-    start = time.time()
-
-    print("")
-    print("================================")
-    print("")
-    print(" >>>>>>> Number of permutations : ",  num_perms)
-
-    lsh = LocalitySensitiveHashing(
-        datafile=datafile,
-        dim=num_perms,
-        r=50,
-        b=100,
-        expected_num_of_clusters=5,
-    )
-    lsh.get_data_from_csv()
-    lsh.initialize_hash_store()
-    lsh.hash_all_data()
-    similarity_groups = lsh.lsh_basic_for_neighborhood_clusters()
-    coalesced_similarity_groups = lsh.merge_similarity_groups_with_coalescence(
-        similarity_groups)
-    merged_similarity_groups = lsh.merge_similarity_groups_with_l2norm_sample_based(
-        coalesced_similarity_groups)
-
-    end = time.time()
-    diff = end - start
-    print(diff, " : seconds ")
-
-    # print("lsh bucket : ", len(merged_similarity_groups))
-    total_doc_number = []
-    all_pairs_container = []
-
-    max_buckets = max(merged_similarity_groups, key=len)
-    # print("total max bucket length : ", len(max_buckets))
-    # print("--")
-
-    all_max_bucket_pairs = []
-    for bucket_doc in max_buckets:
-        doc_num = bucket_doc.split("_")[1]
-        all_max_bucket_pairs.append(processedTweets[int(doc_num)].split(" "))
-
-    flat_lsh = itertools.chain.from_iterable(all_max_bucket_pairs)
-    flatLshList = list(flat_lsh)
-
-    filtered_lsh_token = []
-
-    for tokens in flatLshList:
-        pos = nltk.pos_tag(word_tokenize(tokens))
-
-        # get token name
-        if pos == []:
-            continue
-
-        token_name = pos[0][0]
-
-        # get pos name
-        pos_name = pos[0][1]
-
-        if pos_name in accepted_pos:
-            filtered_lsh_token.append(token_name)
-
-    # print(filtered_lsh_token)
-    mostLshWord = dict(zip(*np.unique(filtered_lsh_token, return_counts=True)))
-    print("LSH Clustering Most word : ", Counter(mostLshWord).most_common(2))
-
-    for i, bucket in enumerate(merged_similarity_groups):
-
-        if (len(bucket) == 1):
-            print("exiting bucket #", i, " because len is 1")
+def similar_tweets(groups, documents, weights, threshold=0.75):
+    """
+    The tweets of groups that are within cosine threshold of another tweet of
+    their group, in tweet order.  documents[i] is the preprocessed text of
+    tweet i and weights[i] the number of copies it stands for.  Both tweets of
+    every pair are kept, and a tweet with several copies is a pair with its
+    own copies, so which tweets are kept, and how often, is the same whether
+    duplicates were collapsed or not.
+    """
+    from SetSimilaritySearch import all_pairs
+    chosen = set()
+    for group in groups:
+        doc_nums = sorted(group)
+        chosen.update(doc_num for doc_num in doc_nums if weights[doc_num] > 1)
+        if len(doc_nums) < 2:
             continue
-
-        doc_num_list = []
-
-        bucket_pairs = []
-        for document in bucket:
-            doc_num = document.split("_")[1]
-
-            doc_num_list.append(doc_num)
-
-            bucket_pairs.append(processedTweets[int(doc_num)].split(" "))
-
-        all_pairs_container.append(bucket_pairs)
-        total_doc_number.append(doc_num_list)
-
-    # print("++++++++++++++++++++++++++++")
-    # print(all_pairs_container)
-    # sys.exit(0)
-    # print("++++++++++++++++++++++++++++")
-
-    total_doc = set()
-    total_list_doc = []
-
-    # print(" >>>>>>>>>>>>>>>>>> : Cosine Similarity")
+        # all_pairs wants sets of distinct tokens
+        sets = [sorted(set(documents[doc_num].split(" "))) for doc_num in doc_nums]
+        for x, y, _ in all_pairs(sets, similarity_func_name="cosine", similarity_threshold=threshold):
+            chosen.add(doc_nums[x])
+            chosen.add(doc_nums[y])
+    return sorted(chosen)
+
+
+def cluster_rows(features, weights, eps=0.5, min_samples=2):
+    """
+    The 2-D PCA projection of the TF-IDF rows features and their DBSCAN
+    labels, row i counting as weights[i] tweets.  The PCA is fit with every
+    row repeated once per copy and the scaler and DBSCAN take the weights as
+    sample weights, so the result is that of the uncollapsed rows.  With
+    fewer than two rows or columns all the rows are labelled noise (-1).
+    """
+    import numpy as np
+    from sklearn.cluster import DBSCAN
+    from sklearn.decomposition import PCA
+    from sklearn.preprocessing import StandardScaler
+    import scipy.sparse
+    rows = features[np.repeat(np.arange(features.shape[0]), weights)]
+    if min(rows.shape) < 2:
+        # too few rows or columns for two components: every row is noise
+        return np.zeros((features.shape[0], 2)), np.full(features.shape[0], -1)
+    if min(rows.shape) > 2:
+        # With the arpack solver PCA centers the sparse rows implicitly, so the
+        # dense N x V matrix is never built
+        pca = PCA(n_components=2, svd_solver='arpack', random_state=0).fit(rows)
+    else:
+        # arpack needs more than two rows and columns; such a matrix is small enough to densify
+        if scipy.sparse.issparse(features):
+            rows, features = rows.toarray(), features.toarray()
+        pca = PCA(n_components=2, svd_solver='full').fit(rows)
+    pca_2d = pca.transform(features)
+    X_scaled = StandardScaler().fit_transform(pca_2d, sample_weight=weights)
+    return pca_2d, DBSCAN(eps=eps, min_samples=min_samples).fit_predict(X_scaled, sample_weight=weights)
+
+
+def largest_cluster(labels, weights, first_seen):
+    """
+    The label of the cluster, noise aside, that stands for the most tweets,
+    and that number; of clusters of equal size, the one with the earliest
+    tweet in the stream (first_seen) wins, whatever the order of the rows
+    """
+    sizes, earliest = Counter(), {}
+    for label, weight, seen in zip(labels, weights, first_seen):
+        if label != -1:
+            sizes[label] += int(weight)
+            earliest[label] = min(earliest.get(label, seen), seen)
+    label = max(sizes, key=lambda label: (sizes[label], -earliest[label]))
+    return label, sizes[label]
+
+
+def main():
+    """Cluster the tweets of ds.csv and print the trending words of every run"""
+    # numpy, pandas, scikit-learn, nltk and the LSH modules take seconds to import,
+    # so this module and its helpers only import them once main() runs
+    import numpy as np
+
+    from ELocalitySensitiveHashing import LocalitySensitiveHashing
+    from batchMinHash import minhash_signatures
+    from hashedFeatures import HashedTfidf, preshingled, weighted_tfidf
+    from preprocessingCache import config_fingerprint
+    from signatureStore import (SignatureArrayWriter, SignatureStoreWriter, open_signature_store,
+                                read_signature_header)
+    from tweetDedup import DuplicateCollapser
+    from tweetPreprocessing import preprocess_tweet_chunks
+    from tweetStream import read_tweet_chunks, ngram_shingles, stream_ngram_minhash_signatures
+
+    # df = pd.read_csv('movie_reviews.csv')
+    if stream_chunk_size is None:
+        import pandas as pd
+        df = pd.read_csv('ds.csv')
+
+        tweets_df = df.review[:tweet_limit]
+
+        print("size of dataset : ", tweets_df.shape)
+        tweetChunks = [tweets_df]
+    else:
+        # read ds.csv a bounded chunk at a time instead of loading it whole
+        tweetChunks = read_tweet_chunks(
+            'ds.csv', chunk_size=stream_chunk_size, limit=tweet_limit)
+
+    permutation_list = [64, 128, 256, 512]
+
+    processedTweets = []
+    # The accepted_pos words of every tweet, tagged in the context of the tweet
+    # during preprocessing; the trending-word stages only look them up
+    tweetNouns = []
+    cacheCounts = Counter()
+    # processedTweets holds every distinct document once; duplicates.weights
+    # counts the tweets that each of them stands for
+    duplicates = DuplicateCollapser()
+
+    def preprocessed_documents():
+        """
+        Preprocess each chunk of tweets, keep the words of its new documents and
+        yield them, together with the documents that repeat earlier ones
+        """
+        for preprocessed in preprocess_tweet_chunks(
+                tweetChunks, workers=preprocess_workers, pos_tags=True,
+                cache_dir=preprocess_cache_dir, tokenizer=tweet_tokenizer):
+            if collapse_duplicate_tweets:
+                new = duplicates.add(preprocessed.documents)
+            else:
+                new = range(len(preprocessed.documents))
+                duplicates.add_singletons(len(new))
+            documents = [preprocessed.documents[i] for i in new]
+            processedTweets.extend(documents)
+            tweetNouns.extend(
+                [word for word, tag in zip(preprocessed.words[i], preprocessed.pos_tags[i])
+                 if tag in accepted_pos] for i in new)
+            cacheCounts.update(hits=preprocessed.cache_info.hits,
+                               misses=preprocessed.cache_info.misses)
+            new = set(new)
+            yield documents, [document for position, document in enumerate(preprocessed.documents)
+                              if position not in new]
+
+    # print(" >>>>>>>>>>>>>>>>>> : Preprocessing Tweet")
+    # print(" >>>>>>>>>>>>>>>>>> : Min Hashing")
     start = time.time()
 
-    for index, bucket_pairs in enumerate(all_pairs_container):
-
-        child_set = set()
-
-        # The input sets must be a Python list of iterables (i.e., lists or sets).
-        # [[1, 2, 3], [3, 4, 5], [2, 3, 4], [5, 6, 7]]
-        sets = all_pairs_container[index]
-        # all_pairs returns an iterable of tuples.
-
-        # print("**********************************")
-        # print(sets)
-        # print("**********************************")
-
-        pairs = all_pairs(sets, similarity_func_name="cosine",
-                          similarity_threshold=0.75)
-        total_tuples = list(pairs)
-
-        for tup_data in total_tuples:
-            total_doc.add(total_doc_number[index][tup_data[0]])
-
-    # print("Total doc length : ", len(total_doc))
-
-    feature_list = []
-    for d in total_doc:
-        feature_list.append(XA[int(d)])
+    # MinHash of each tweet's set of n-grams for every n-gram size, chunk by chunk
+    # as the tweets are preprocessed, all sizes cut from one tokenization of the
+    # chunk and hashed once at 512 permutations; the smaller signatures are
+    # prefix views of it
+    num_perm = max(permutation_list)
+    hashedTfidfs = dict((n, HashedTfidf(analyzer=preshingled)) for n in ngram_sizes)
+
+    def hashed_signature_blocks():
+        """MinHash the hashed n-grams of each chunk and update the IDF estimates"""
+        for documents, repeated in preprocessed_documents():
+            if repeated:
+                # the copies of a collapsed tweet still count in the document frequencies
+                repeated_shingles = ngram_shingles(repeated, ngram_sizes)
+                for n in ngram_sizes:
+                    hashedTfidfs[n].partial_fit(repeated_shingles[n])
+            shingles = ngram_shingles(documents, ngram_sizes)
+            yield dict((n, hashedTfidfs[n].partial_fit_minhash(
+                shingles[n], num_perm=num_perm, seed=3)) for n in ngram_sizes)
+
+    def minhash_blocks(documents):
+        """{n: MinHash signatures of documents}, leaving the IDF estimates as they are"""
+        if featurization != 'hashing':
+            return next(stream_ngram_minhash_signatures([documents], ngram_sizes, num_perm=num_perm, seed=3))
+        shingles = ngram_shingles(documents, ngram_sizes)
+        return dict((n, minhash_signatures(
+            hashedTfidfs[n].counts(shingles[n]), num_perm=num_perm, seed=3,
+            hashes=np.arange(hashedTfidfs[n].n_features, dtype=np.uint64))) for n in ngram_sizes)
+
+    def stored_signatures_match(filename, rows=None):
+        """Whether filename is a store of this run's MinHash signatures, with rows rows if given"""
+        if not os.path.exists(filename):
+            return False
+        try:
+            header = read_signature_header(filename)
+        except ValueError:
+            # e.g. left behind by a run that stopped while writing it
+            return False
+        return (header['kind'] == 'minhash' and header['seed'] == 3 and header['num_perm'] == num_perm
+                and header['shape'][1] == num_perm and rows in (None, header['shape'][0]))
+
+    maxSignatures = None
+    if signature_dir is not None:
+        # the signatures only depend on the tweets of ds.csv and on these settings
+        source = os.stat('ds.csv')
+        fingerprint = config_fingerprint(
+            source_size=source.st_size, source_mtime=source.st_mtime_ns, tweet_limit=tweet_limit,
+            featurization=featurization, tokenizer=tweet_tokenizer,
+            collapse_duplicates=collapse_duplicate_tweets, seed=3, num_perm=num_perm)
+        storeFiles = dict((n, os.path.join(
+            signature_dir, "minhash_%dgram_%d_%s.sig" % (n, num_perm, fingerprint))) for n in ngram_sizes)
+    if signature_dir is not None and all(stored_signatures_match(storeFiles[n]) for n in ngram_sizes):
+        # preprocess for the words and the IDF estimates only, the signatures are on disk
+        for documents, repeated in preprocessed_documents():
+            if featurization == 'hashing':
+                shingles = ngram_shingles(documents + repeated, ngram_sizes)
+                for n in ngram_sizes:
+                    hashedTfidfs[n].partial_fit(shingles[n])
+        if all(stored_signatures_match(storeFiles[n], rows=len(processedTweets)) for n in ngram_sizes):
+            print("Reusing the MinHash signatures in ", signature_dir)
+            maxSignatures = dict((n, open_signature_store(storeFiles[n])[1]) for n in ngram_sizes)
+        else:
+            signatureBlocks = [minhash_blocks(processedTweets)]
+    elif featurization == 'hashing':
+        signatureBlocks = hashed_signature_blocks()
+    else:
+        signatureBlocks = stream_ngram_minhash_signatures(
+            (documents for documents, _ in preprocessed_documents()),
+            ngram_sizes, num_perm=num_perm, seed=3)
+    if maxSignatures is None and signature_dir is not None:
+        writers = dict((n, SignatureStoreWriter(storeFiles[n], seed=3, num_perm=num_perm))
+                       for n in ngram_sizes)
+        for blocks in signatureBlocks:
+            for n in ngram_sizes:
+                writers[n].append(blocks[n])
+        maxSignatures = {}
+        for n in ngram_sizes:
+            writers[n].close()
+            _, maxSignatures[n] = open_signature_store(writers[n].filename)
+    elif maxSignatures is None:
+        # copy each block into place as it arrives; tweet_limit bounds the rows
+        writers = dict((n, SignatureArrayWriter(tweet_limit or stream_chunk_size or 1024))
+                       for n in ngram_sizes)
+        for blocks in signatureBlocks:
+            for n in ngram_sizes:
+                writers[n].append(blocks[n])
+        maxSignatures = dict((n, writers[n].close()) for n in ngram_sizes)
+    docIds = ["doc_" + str(index) for index in range(len(processedTweets))]
+    tweetWeights = duplicates.weight_array()
+    tweetFirstSeen = duplicates.first_position_array()
+    tweetCopyOf = duplicates.distinct_index_array()
+    print("Distinct tweets : ", len(processedTweets), " of ", tweetWeights.sum(),
+          " (%d duplicates collapsed)" % (tweetWeights.sum() - len(processedTweets)))
+
+    print("Token cache : ", dict(cacheCounts), " hit rate : %.1f%%"
+          % (100.0 * cacheCounts['hits'] / max(1, sum(cacheCounts.values()))))
+
+    if featurization == 'tfidf' and stream_chunk_size is None:
+        # Kept as scipy CSR matrices; a dense N x V copy does not fit in memory at scale.
+        # The IDF counts every collapsed copy of a tweet.
+        XA = dict((n, weighted_tfidf(processedTweets, tweetWeights, ngram_range=(n, n)))
+                  for n in ngram_sizes)
+
+    def trending_words(doc_nums):
+        """Counts of the accepted_pos words of doc_nums, each counted once per copy of its tweet"""
+        words = [word for doc_num in doc_nums for word in tweetNouns[doc_num]]
+        copies = [tweetWeights[doc_num] for doc_num in doc_nums for _ in tweetNouns[doc_num]]
+        unique_words, word_index = np.unique(words, return_inverse=True)
+        counts = np.bincount(word_index, weights=copies, minlength=len(unique_words)).astype(np.int64)
+        return Counter(dict(zip(unique_words, counts)))
 
     end = time.time()
     diff = end - start
     # print(diff, " : seconds ")
 
-    pca = PCA(n_components=2).fit(feature_list)
-    pca_2d = pca.transform(feature_list)
-
-    X = pca_2d
-
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-
-    # print(" >>>>>>>>>>>>>>>>>> : DBSCAN Clustering")
-    start = time.time()
-
-    # cluster the data into five clusters
-    dbscan = DBSCAN(eps=0.5, min_samples=2)
-    clusters = dbscan.fit_predict(X_scaled)
-
-    # print(" >>>>> cluster size:  ", set(clusters))
-
-    unique_cluster = set(clusters)
-
-    if len(unique_cluster) == 1:
-        print("No cluster available, just noise")
-        sys.exit(0)
+    for ngram_size, num_perms in itertools.product(ngram_sizes, permutation_list):
+
+        minHashMatrix = maxSignatures[ngram_size][:, :num_perms]
+
+        print(" >>>>>>>>>>>>>>>>>> : LSH")
+        start = time.time()
+
+        print("")
+        print("================================")
+        print("")
+        print(" >>>>>>> N-gram size : ",  ngram_size)
+        print(" >>>>>>> Number of permutations : ",  num_perms)
+
+        lsh = LocalitySensitiveHashing.from_array(
+            minHashMatrix, ids=docIds, weights=tweetWeights, r=50, b=100, expected_num_of_clusters=5,
+            max_bucket_size=max_bucket_size, oversized_bucket_strategy=oversized_bucket_strategy)
+        lsh.initialize_hash_store()
+        lsh.hash_all_data()
+        similarity_groups = lsh.lsh_basic_for_neighborhood_clusters()
+        if max_bucket_size is not None:
+            print("Oversized buckets : ", lsh.bucket_stats['oversized_buckets'],
+                  " collapsed tweets : ", lsh.bucket_stats['collapsed_samples'],
+                  " candidate pairs avoided : %d of %d" % (lsh.bucket_stats['candidate_pairs_avoided'],
+                                                            lsh.bucket_stats['candidate_pairs_before']))
+        # the coalescence is a single greedy pass over the groups in order, so the group of
+        # a collapsed tweet is taken again wherever one of its copies was in the stream
+        coalesced_similarity_groups = lsh.merge_similarity_groups_with_coalescence(
+            similarity_groups[i] for i in tweetCopyOf.tolist())
+        merged_similarity_groups = lsh.merge_similarity_groups_with_l2norm_sample_based(
+            coalesced_similarity_groups)
+
+        end = time.time()
+        diff = end - start
+        print(diff, " : seconds ")
+
+        # print("lsh bucket : ", len(merged_similarity_groups))
+
+        # the group that stands for the most tweets, counting collapsed copies
+        max_buckets = max(merged_similarity_groups, key=lsh.group_weight)
+        # print("total max bucket length : ", len(max_buckets))
+        # print("--")
+
+        mostLshWord = trending_words(max_buckets)
+        print("LSH Clustering Most word : ", mostLshWord.most_common(2))
+
+        for i, bucket in enumerate(merged_similarity_groups):
+
+            if (lsh.group_weight(bucket) == 1):
+                print("exiting bucket #", i, " because len is 1")
+
+        # print(" >>>>>>>>>>>>>>>>>> : Cosine Similarity")
+        start = time.time()
+
+        # the tweets with a near-duplicate in their group; row i of the
+        # features below is the tweet total_doc[i]
+        total_doc = similar_tweets(merged_similarity_groups, processedTweets, tweetWeights)
+        docWeights = tweetWeights[total_doc]
+
+        # print("Total doc length : ", len(total_doc))
+
+        if featurization == 'hashing':
+            feature_list = hashedTfidfs[ngram_size].transform(ngram_shingles(
+                [processedTweets[doc_num] for doc_num in total_doc],
+                [ngram_size])[ngram_size])
+        elif stream_chunk_size is None:
+            feature_list = XA[ngram_size][total_doc]
+        else:
+            # no corpus-wide vocabulary when streaming; vectorize only these rows
+            feature_list = weighted_tfidf([processedTweets[doc_num] for doc_num in total_doc],
+                                          docWeights, ngram_range=(ngram_size, ngram_size))
 
-    color_code = ['r', 'g', 'b', 'y', 'w', 'o', 'v', 'p']
-    # marker_code = ['+', '*', 'o', 'h', 'p', '1', '2', '3']
-    marker_code = ['o', '.', ',', 'x', '+', 'v', '^', '<', '>', 's', 'd']
+        end = time.time()
+        diff = end - start
+        # print(diff, " : seconds ")
 
-    cluster_dict = {}
-    for l in unique_cluster:
-        cluster_dict[l] = {"document": [], "x": [], "y": []}
+        # print(" >>>>>>>>>>>>>>>>>> : DBSCAN Clustering")
+        start = time.time()
 
-    for i in range(pca_2d.shape[0]):
-        cluster_dict[dbscan.labels_[i]]["document"].append(i)
-        cluster_dict[dbscan.labels_[i]]["x"].append(pca_2d[i, 0])
-        cluster_dict[dbscan.labels_[i]]["y"].append(pca_2d[i, 1])
+        pca_2d, clusters = cluster_rows(feature_list, docWeights)
 
-    # print("============================================================")
-    # print(" >>>>>> Cluster dict : ", cluster_dict)
-    # for i in range(pca_2d.shape[0]):
+        # print(" >>>>> cluster size:  ", set(clusters))
 
-    #     if dbscan.labels_[i] == 0:
-    #         c1 = plt.scatter(pca_2d[i, 0], pca_2d[i, 1], c='r', marker='+')
-    #     elif dbscan.labels_[i] == 1:
-    #         c2 = plt.scatter(pca_2d[i, 0], pca_2d[i, 1], c='g', marker='o')
-    #     elif dbscan.labels_[i] == -1:
-    #         c3 = plt.scatter(pca_2d[i, 0], pca_2d[i, 1], c='b', marker='*')
+        unique_cluster = set(clusters)
 
-    # print(dbscan.labels_)
-    # print("=====================")
+        if not unique_cluster - {-1}:
+            # go on with the next n-gram size and number of permutations
+            print("No cluster available, just noise")
+            continue
 
-    # filter(lambda a: a != -1, dbscan.labels_)
-    removeNoise = [y for y in dbscan.labels_ if y != -1]
-    c = Counter(removeNoise)
-    mostCluster = c.most_common(1)
+        color_code = ['r', 'g', 'b', 'y', 'w', 'o', 'v', 'p']
+        # marker_code = ['+', '*', 'o', 'h', 'p', '1', '2', '3']
+        marker_code = ['o', '.', ',', 'x', '+', 'v', '^', '<', '>', 's', 'd']
 
-    # print("Cluster with most document : ", mostCluster)
+        cluster_dict = {}
+        for l in unique_cluster:
+            cluster_dict[l] = {"document": [], "x": [], "y": []}
 
-    documentKey = mostCluster[0][0]
-    documentCount = mostCluster[0][1]
+        # the rows of pca_2d are positions in total_doc, not tweet numbers
+        for i in range(pca_2d.shape[0]):
+            cluster_dict[clusters[i]]["document"].append(total_doc[i])
+            cluster_dict[clusters[i]]["x"].append(pca_2d[i, 0])
+            cluster_dict[clusters[i]]["y"].append(pca_2d[i, 1])
 
-    # print("Cluster dictionary : ")
+        # print("============================================================")
+        # print(" >>>>>> Cluster dict : ", cluster_dict)
+        # for i in range(pca_2d.shape[0]):
 
-    most_cluster_documents = cluster_dict.get(documentKey).get('document')
+        #     if dbscan.labels_[i] == 0:
+        #         c1 = plt.scatter(pca_2d[i, 0], pca_2d[i, 1], c='r', marker='+')
+        #     elif dbscan.labels_[i] == 1:
+        #         c2 = plt.scatter(pca_2d[i, 0], pca_2d[i, 1], c='g', marker='o')
+        #     elif dbscan.labels_[i] == -1:
+        #         c3 = plt.scatter(pca_2d[i, 0], pca_2d[i, 1], c='b', marker='*')
 
-    # print("Most cluster Document : ", most_cluster_documents)
+        # print(dbscan.labels_)
+        # print("=====================")
 
-    most_cluster_documents_docs = []
+        documentKey, documentCount = largest_cluster(clusters, docWeights, tweetFirstSeen[total_doc])
 
-    for doc_id in most_cluster_documents:
-        most_cluster_documents_docs.append(tokenizedTweets[doc_id])
+        # print("Cluster with most document : ", documentKey, documentCount)
 
-    end = time.time()
-    diff = end - start
-    # print(diff, " : seconds ")
+        # print("Cluster dictionary : ")
 
-    print(" >>>>>>>>>>>>>>>>>> : Trending Topic")
-    start = time.time()
+        most_cluster_documents = cluster_dict.get(documentKey).get('document')
 
-    # print("doc key : ", documentKey, " -- ", "doc count : ", documentCount)
+        # print("Most cluster Document : ", most_cluster_documents)
 
-    flat = itertools.chain.from_iterable(most_cluster_documents_docs)
-    flatList = list(flat)
+        end = time.time()
+        diff = end - start
+        # print(diff, " : seconds ")
 
-    filtered_token = []
-    for tokens in flatList:
-        pos = nltk.pos_tag([tokens])
+        print(" >>>>>>>>>>>>>>>>>> : Trending Topic")
+        start = time.time()
 
-        # get token name
-        token_name = pos[0][0]
+        # print("doc key : ", documentKey, " -- ", "doc count : ", documentCount)
 
-        # get pos name
-        pos_name = pos[0][1]
+        mostWord = trending_words(most_cluster_documents)
+        print("DBSCAN Clustering Most word : ", mostWord.most_common(2))
 
-        if pos_name in accepted_pos:
-            # print(token_name, " -- ", pos_name)
-            filtered_token.append(token_name)
+        end = time.time()
+        diff = end - start
+        # print(diff, " : seconds ")
+        # sys.exit(0)
 
-    # print(filtered_token)
-    # sys.exit(0)
-    mostWord = dict(zip(*np.unique(filtered_token, return_counts=True)))
-    print("DBSCAN Clustering Most word : ", Counter(mostWord).most_common(2))
+        # for index, key in enumerate(cluster_dict.keys()):
+        # print(cluster_dict[key])
 
-    end = time.time()
-    diff = end - start
-    # print(diff, " : seconds ")
-    # sys.exit(0)
+        # x = np.asarray(list(cluster_dict[key]["x"]))
+        # y = np.asarray(list(cluster_dict[key]["y"]))
 
-    # for index, key in enumerate(cluster_dict.keys()):
-    # print(cluster_dict[key])
+        # print(x.shape)
+        # print(y.shape)
+        # plt.scatter(x, y, c=color_code[index], marker=marker_code[index])
 
-    # x = np.asarray(list(cluster_dict[key]["x"]))
-    # y = np.asarray(list(cluster_dict[key]["y"]))
+        # sys.exit(0)
 
-    # print(x.shape)
-    # print(y.shape)
-    # plt.scatter(x, y, c=color_code[index], marker=marker_code[index])
+        # plt.legend([c1, c2, c3], ['Cluster 1', 'Cluster 2', 'Noise'])
+        # plt.legend([k for k in legend], [k for k in legend])
+        # print(legend)
+        # plt.title('DBSCAN finds 2 clusters and noise')
+        # plt.show()
 
-    # sys.exit(0)
+        # print("")
+        # print(colors)
 
-    # plt.legend([c1, c2, c3], ['Cluster 1', 'Cluster 2', 'Noise'])
-    # plt.legend([k for k in legend], [k for k in legend])
-    # print(legend)
-    # plt.title('DBSCAN finds 2 clusters and noise')
-    # plt.show()
 
-    # print("")
-    # print(colors)
+if __name__ == '__main__':
+    main()
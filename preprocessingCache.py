@@ -0,0 +1,149 @@
+'''
+Persistent cache of preprocessed tweets, so that a run of lsHash.py only
+normalizes and tags the tweets that no earlier run has seen.
+
+An entry is keyed by a 64-bit BLAKE2b hash of the tweet text.  The
+normalizer settings are folded into a fingerprint that names the cache file,
+so changing a setting starts a new cache instead of serving stale words.
+A cache file is a numpy .npz archive of flat arrays:
+
+    keys          uint64   content hash of every cached tweet
+    offsets       int64    start of the words of tweet i in word_ids; the
+                           words of tweet i are word_ids[offsets[i]:offsets[i + 1]]
+    word_ids      uint32   index of every word in vocabulary
+    tag_ids       uint16   index of the tag of every word in tagset, or an
+                           empty array if the cache holds no tags
+    vocabulary    uint8    UTF-8 words joined with newlines
+    tagset        uint8    UTF-8 tags joined with newlines
+
+The joined document of a tweet is ' '.join(words) and is rebuilt on lookup
+rather than stored.
+'''
+import hashlib
+import json
+import os
+
+import numpy
+
+FORMAT_VERSION = 1
+
+
+def tweet_key(tweet):
+    """64-bit content hash of a tweet; missing tweets hash like the empty string"""
+    text = tweet if isinstance(tweet, str) else ''
+    return int.from_bytes(hashlib.blake2b(text.encode('utf8'), digest_size=8).digest(), 'little')
+
+
+def config_fingerprint(**settings):
+    """Short hash of the settings that determine the preprocessed output"""
+    settings = dict(settings, format_version=FORMAT_VERSION)
+    encoded = json.dumps(settings, sort_keys=True).encode('utf8')
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def _join_strings(strings):
+    return numpy.frombuffer('\n'.join(strings).encode('utf8'), dtype=numpy.uint8)
+
+
+def _split_strings(array):
+    text = array.tobytes().decode('utf8')
+    return text.split('\n') if text else []
+
+
+class PreprocessingCache(object):
+    '''
+    The cache file for one settings fingerprint in directory.  lookup() and
+    add() work in memory; save() writes the file back if anything was added.
+    '''
+
+    def __init__(self, directory, fingerprint, pos_tags=False):
+        self.filename = os.path.join(directory, 'preprocessed_%s.npz' % fingerprint)
+        self.pos_tags = pos_tags
+        self.vocabulary = []
+        self.tagset = []
+        self._word_index = {}
+        self._tag_index = {}
+        # content hash -> (word ids, tag ids or None)
+        self._entries = {}
+        self._added = 0
+        if os.path.exists(self.filename):
+            self._load()
+
+    def _load(self):
+        with numpy.load(self.filename) as archive:
+            keys = archive['keys']
+            offsets = archive['offsets']
+            word_ids = archive['word_ids']
+            tag_ids = archive['tag_ids']
+            self.vocabulary = _split_strings(archive['vocabulary'])
+            self.tagset = _split_strings(archive['tagset'])
+        self._word_index = dict((word, index) for index, word in enumerate(self.vocabulary))
+        self._tag_index = dict((tag, index) for index, tag in enumerate(self.tagset))
+        has_tags = len(tag_ids) == len(word_ids)
+        for index, key in enumerate(keys.tolist()):
+            start, end = offsets[index], offsets[index + 1]
+            self._entries[key] = (word_ids[start:end], tag_ids[start:end] if has_tags else None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def lookup(self, key):
+        """Return (document, words, tags) for a content hash, or None if it is not cached"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        word_ids, tag_ids = entry
+        vocabulary = self.vocabulary
+        words = [vocabulary[index] for index in word_ids.tolist()]
+        tags = None
+        if self.pos_tags:
+            tagset = self.tagset
+            tags = tuple(tagset[index] for index in tag_ids.tolist())
+        return ' '.join(words), words, tags
+
+    def _ids(self, strings, index, table):
+        ids = []
+        for string in strings:
+            position = index.get(string)
+            if position is None:
+                position = index[string] = len(table)
+                table.append(string)
+            ids.append(position)
+        return ids
+
+    def add(self, key, words, tags=None):
+        word_ids = numpy.array(self._ids(words, self._word_index, self.vocabulary), dtype=numpy.uint32)
+        tag_ids = None
+        if self.pos_tags:
+            tag_ids = numpy.array(self._ids(tags, self._tag_index, self.tagset), dtype=numpy.uint16)
+        self._entries[key] = (word_ids, tag_ids)
+        self._added += 1
+
+    def save(self):
+        """Write the cache file if entries were added since it was loaded"""
+        if not self._added:
+            return
+        keys = list(self._entries)
+        entries = [self._entries[key] for key in keys]
+        offsets = numpy.zeros(len(entries) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(word_ids) for word_ids, _ in entries])
+        empty_words = numpy.zeros(0, dtype=numpy.uint32)
+        empty_tags = numpy.zeros(0, dtype=numpy.uint16)
+        word_ids = numpy.concatenate([word_ids for word_ids, _ in entries] or [empty_words])
+        if self.pos_tags:
+            tag_ids = numpy.concatenate([tag_ids for _, tag_ids in entries] or [empty_tags])
+        else:
+            tag_ids = empty_tags
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # write next to the cache and rename, so a crash never leaves half a file
+        temporary = self.filename + '.tmp.npz'
+        numpy.savez(temporary, keys=numpy.array(keys, dtype=numpy.uint64), offsets=offsets,
+                    word_ids=word_ids.astype(numpy.uint32), tag_ids=tag_ids.astype(numpy.uint16),
+                    vocabulary=_join_strings(self.vocabulary), tagset=_join_strings(self.tagset))
+        os.replace(temporary, self.filename)
+        self._added = 0
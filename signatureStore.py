@@ -0,0 +1,176 @@
+'''
+Binary on-disk store for signature matrices, opened with numpy.memmap so that
+banding and clustering can run against signatures that do not fit in memory.
+
+A store is a 64-byte little-endian header followed by the raw C-ordered
+matrix.  The header holds:
+
+    magic       8 bytes   b'LSHSIG01'
+    kind        8 bytes   b'minhash' for MinHash hashvalues, b'hplane' for
+                          packed hyperplane sign bits
+    dtype       8 bytes   numpy dtype string of the matrix, e.g. b'<u8'
+    rows        uint64    number of samples
+    cols        uint64    number of columns
+    seed        int64     seed of the hash functions, -1 if unknown
+    num_perm    int64     number of MinHash permutations, -1 if not a MinHash
+    num_bits    int64     number of hyperplane bits packed in each row, -1 if
+                          not a hyperplane signature
+
+SignatureArrayWriter collects streamed blocks the same way in memory, for
+runs that keep no store.
+'''
+import struct
+
+import numpy
+
+MAGIC = b'LSHSIG01'
+HEADER = struct.Struct('<8s8s8sQQqqq')
+HEADER_SIZE = HEADER.size
+
+
+def _encode(value):
+    return -1 if value is None else int(value)
+
+
+def _decode(value):
+    return None if value == -1 else value
+
+
+def create_signature_store(filename, shape, dtype, kind='minhash', seed=None, num_perm=None, num_bits=None):
+    """Create a store of the given shape and return it as a writable memmap to be filled in"""
+    dtype = numpy.dtype(dtype)
+    rows, cols = shape
+    with open(filename, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, kind.encode('ascii'), dtype.str.encode('ascii'), rows, cols,
+                                 _encode(seed), _encode(num_perm), _encode(num_bits)))
+    return numpy.memmap(filename, dtype=dtype, mode='r+', offset=HEADER_SIZE, shape=(rows, cols))
+
+
+def write_signature_store(filename, matrix, kind='minhash', seed=None, num_perm=None, num_bits=None):
+    """Write a whole in-memory signature matrix to a store"""
+    matrix = numpy.asarray(matrix)
+    store = create_signature_store(filename, matrix.shape, matrix.dtype, kind=kind, seed=seed,
+                                   num_perm=num_perm, num_bits=num_bits)
+    store[:] = matrix
+    store.flush()
+    return store
+
+
+class SignatureStoreWriter(object):
+    '''
+    Writes a store one block of rows at a time, for signatures computed in a
+    stream whose length is not known in advance.  The header is filled in by
+    close().
+    '''
+
+    def __init__(self, filename, kind='minhash', seed=None, num_perm=None, num_bits=None):
+        self.filename = filename
+        self.kind = kind
+        self.seed = seed
+        self.num_perm = num_perm
+        self.num_bits = num_bits
+        self.rows, self.cols, self.dtype = 0, None, None
+        self._output = open(filename, 'wb')
+        self._output.write(b'\0' * HEADER_SIZE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._output is not None:
+            # leave the header zeroed, so the partial file is not taken for a store, and let the error through
+            self._output.close()
+            self._output = None
+
+    def append(self, block):
+        block = numpy.ascontiguousarray(block)
+        if self.dtype is None:
+            self.dtype, self.cols = block.dtype, block.shape[1]
+        elif block.dtype != self.dtype or block.shape[1] != self.cols:
+            raise ValueError("all the blocks of a store must have the same width and dtype")
+        self._output.write(block.tobytes())
+        self.rows += block.shape[0]
+
+    def close(self):
+        """Write the header and return it"""
+        if self._output is None:
+            return read_signature_header(self.filename)
+        output, self._output = self._output, None
+        with output:
+            if self.dtype is None:
+                raise ValueError("no blocks were written to %s" % self.filename)
+            output.seek(0)
+            output.write(HEADER.pack(MAGIC, self.kind.encode('ascii'), self.dtype.str.encode('ascii'), self.rows,
+                                     self.cols, _encode(self.seed), _encode(self.num_perm), _encode(self.num_bits)))
+        return read_signature_header(self.filename)
+
+
+class SignatureArrayWriter(object):
+    '''
+    The in-memory counterpart of SignatureStoreWriter.  Each block of rows is
+    copied into one array as it arrives, so the blocks are not kept until the
+    end to be stacked.  The array has room for capacity rows to begin with and
+    doubles whenever it fills up; close() trims it to the rows written and
+    returns it.
+    '''
+
+    def __init__(self, capacity=1024):
+        self.capacity = max(1, capacity)
+        self.rows = 0
+        self._array = None
+
+    def append(self, block):
+        block = numpy.asarray(block)
+        if self._array is None:
+            self._array = numpy.empty((self.capacity, block.shape[1]), dtype=block.dtype)
+        elif block.dtype != self._array.dtype or block.shape[1] != self._array.shape[1]:
+            raise ValueError("all the blocks must have the same width and dtype")
+        end = self.rows + block.shape[0]
+        if end > len(self._array):
+            # reallocated in place where the allocator can; no view of it has been handed out
+            self._array.resize((max(end, 2 * len(self._array)), self._array.shape[1]), refcheck=False)
+        self._array[self.rows:end] = block
+        self.rows = end
+
+    def close(self):
+        if self._array is None:
+            raise ValueError("no blocks were written")
+        if self.rows < len(self._array):
+            self._array.resize((self.rows, self._array.shape[1]), refcheck=False)
+        return self._array
+
+
+def write_signature_blocks(filename, blocks, kind='minhash', seed=None, num_perm=None, num_bits=None):
+    """Write a store from an iterable of row blocks of the same width and dtype and return its header"""
+    with SignatureStoreWriter(filename, kind=kind, seed=seed, num_perm=num_perm, num_bits=num_bits) as writer:
+        for block in blocks:
+            writer.append(block)
+    return writer.close()
+
+
+def read_signature_header(filename):
+    with open(filename, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError("%s is not a signature store" % filename)
+    fields = HEADER.unpack(header)
+    if fields[0] != MAGIC:
+        raise ValueError("%s is not a signature store" % filename)
+    return {
+        'kind': fields[1].rstrip(b'\0').decode('ascii'),
+        'dtype': numpy.dtype(fields[2].rstrip(b'\0').decode('ascii')),
+        'shape': (fields[3], fields[4]),
+        'seed': _decode(fields[5]),
+        'num_perm': _decode(fields[6]),
+        'num_bits': _decode(fields[7]),
+    }
+
+
+def open_signature_store(filename, mode='r'):
+    """Return the header of a store and its matrix as a memmap, without reading the matrix"""
+    header = read_signature_header(filename)
+    matrix = numpy.memmap(filename, dtype=header['dtype'], mode=mode, offset=HEADER_SIZE,
+                          shape=header['shape'])
+    return header, matrix
@@ -0,0 +1,80 @@
+'''
+Collapse of duplicate tweets right after preprocessing.
+
+Retweets and templated bot tweets normalize to byte-identical documents.
+A DuplicateCollapser keeps the first copy of every distinct document and
+counts how many copies it stands for, so that MinHash, LSH, the all-pairs
+verification and DBSCAN only process distinct documents while the weights
+keep cluster sizes and word counts equal to those of the full stream.
+Documents are told apart by the 64-bit BLAKE2b content hash of
+preprocessingCache.tweet_key(); with 64 bits, a collision among even ten
+million distinct documents has a probability of about 3 in a million.
+'''
+import numpy
+
+from preprocessingCache import tweet_key
+
+
+class DuplicateCollapser(object):
+    '''
+    Streaming duplicate filter.  add() takes the documents of one chunk at a
+    time and returns the positions of those not seen before, in any chunk;
+    weights[i] is the number of documents that the i-th distinct document
+    stands for and first_positions[i] the position of its first copy in the
+    whole stream; distinct_indices[j] is the distinct document that the j-th
+    document of the stream is a copy of.
+    '''
+
+    def __init__(self):
+        self._index = {}                 # content hash -> index of the distinct document
+        self.weights = []
+        self.first_positions = []
+        self.distinct_indices = []
+        self.how_many_documents = 0
+
+    def add(self, documents):
+        """Count a chunk of documents and return the positions in it of the documents seen for the first time"""
+        index = self._index
+        weights = self.weights
+        new = []
+        for position, document in enumerate(documents):
+            key = tweet_key(document)
+            distinct = index.get(key)
+            if distinct is None:
+                distinct = index[key] = len(weights)
+                weights.append(0)
+                self.first_positions.append(self.how_many_documents + position)
+                new.append(position)
+            weights[distinct] += 1
+            self.distinct_indices.append(distinct)
+        self.how_many_documents += len(documents)
+        return new
+
+    def add_singletons(self, how_many):
+        """Count how_many documents as distinct without looking at them, for when collapsing is off"""
+        self.distinct_indices.extend(range(len(self.weights), len(self.weights) + how_many))
+        self.weights.extend([1] * how_many)
+        self.first_positions.extend(range(self.how_many_documents, self.how_many_documents + how_many))
+        self.how_many_documents += how_many
+
+    def __len__(self):
+        return len(self.weights)
+
+    def weight_array(self):
+        return numpy.array(self.weights, dtype=numpy.int64)
+
+    def first_position_array(self):
+        return numpy.array(self.first_positions, dtype=numpy.int64)
+
+    def distinct_index_array(self):
+        return numpy.array(self.distinct_indices, dtype=numpy.int64)
+
+    def collapsed(self):
+        """The number of documents that were collapsed into an earlier copy"""
+        return self.how_many_documents - len(self.weights)
+
+
+def collapse_duplicates(documents):
+    """Return the positions of the distinct documents and the number of copies of each"""
+    collapser = DuplicateCollapser()
+    return collapser.add(documents), collapser.weight_array()
@@ -0,0 +1,414 @@
+'''
+Tweet preprocessing for the trending-topic pipeline.
+
+TweetNormalizer turns the raw text of a tweet into the list of normalized
+words that lsHash.py builds its documents from.  It loads the stopword list,
+the lemmatizer and the optional stemmer and number speller once, keeps the
+stopwords in a frozenset, and normalizes every word in a single pass.  Given
+a tokenCache.TokenCache, it looks lemmas and stems up there before computing
+them.  For the default settings its output is the same as that of the
+original chain of list-building functions, which is kept below as
+legacy_preprocess() for comparison in benchmark.py.  Tokenizing is done by
+nltk's word_tokenize, or with tokenizer='regex' by regex_tokenize(), a single
+compiled regex that keeps URLs, hashtags and mentions whole.  nltk and
+inflect are imported when a normalizer is first built, not with this module.
+
+TweetPreprocessor normalizes batches of tweets, optionally split into chunks
+over a pool of worker processes that each build their own normalizer and
+token cache; preprocess_tweets() runs it over a whole corpus and
+preprocess_tweet_chunks() over a stream of batches.  It can also tag the parts of speech of the normalized words,
+one pos_tag_sents call per chunk, so that later stages look tags up instead
+of running the tagger on one word at a time.  Given a cache directory it
+keeps the results in a preprocessingCache.PreprocessingCache and only
+processes tweets it has not seen before.
+'''
+import itertools
+import multiprocessing
+import os
+import re
+import unicodedata
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from preprocessingCache import PreprocessingCache, config_fingerprint, tweet_key
+from tokenCache import CacheInfo, TokenCache
+
+url_pattern = re.compile(
+    r'(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:\'".,<>?«»“”‘’]))')
+punctuation_pattern = re.compile(r'[^\w\s]')
+
+# Tokens of the regex tokenizer.  Words keep the punctuation that nltk's
+# Treebank tokenizer keeps inside them (hyphens, slashes, single periods,
+# and commas and colons before digits) and break where it breaks, so that
+# both tokenizers give the same words once the punctuation is stripped.
+tweet_token_pattern = re.compile(r'''
+    (?:https?://|www\d{0,3}[.])\S+                     # URLs
+  | (?<!\w)[#@]\w+                                     # hashtags and mentions
+  | (?:[^\s;@#$%&?!*()\[\]{}<>"“”‘’«»—.,:-]           # words and numbers
+      | [,:](?=\d) | (?<!\.)\.(?!\.) | (?<!-)-(?!-) )+
+''', re.VERBOSE)
+# Clitics the Treebank tokenizer splits off the end of a word
+clitic_pattern = re.compile(r"(?i)^(.*[^'])(n't|'s|'m|'d|'ll|'re|'ve|')$")
+# Words the Treebank tokenizer splits in two, and where
+split_words = {"cannot": 3, "d'ye": 1, "gimme": 3, "gonna": 3, "gotta": 3, "lemme": 3, "more'n": 4,
+               "wanna": 3}
+
+
+def regex_tokenize(tweet):
+    """Split a tweet into words, URLs, hashtags and mentions with one compiled regex"""
+    tokens = []
+    for token in tweet_token_pattern.findall(tweet):
+        split = split_words.get(token.lower())
+        if split is not None:
+            tokens.append(token[:split])
+            tokens.append(token[split:])
+            continue
+        match = clitic_pattern.match(token) if "'" in token else None
+        if match is None:
+            tokens.append(token)
+        else:
+            tokens.extend(match.groups())
+    return tokens
+
+
+tokenizers = ('treebank', 'regex')
+
+
+def load_tokenizer(name):
+    """The tokenize function of one of the tokenizers; nltk is only imported for 'treebank'"""
+    if name not in tokenizers:
+        raise ValueError("tokenizer must be one of %s" % (tokenizers,))
+    if name == 'regex':
+        return regex_tokenize
+    from nltk.tokenize import word_tokenize
+    return word_tokenize
+
+
+# The TweetNormalizer settings, as recorded in preprocessing cache fingerprints
+normalizer_defaults = dict(language='english', lemmatize=True, stem=False, replace_numbers=False,
+                           tokenizer='treebank')
+
+
+class TweetNormalizer(object):
+    '''
+    Reusable normalizer for tweets.  lemmatize, stem and replace_numbers
+    switch the corresponding steps on or off; the defaults match the steps
+    that lsHash.py has always applied.  tokenizer is 'treebank' for nltk's
+    word_tokenize or 'regex' for the much faster regex_tokenize().  cache is
+    an optional TokenCache for the lemmas and stems, which may be shared with
+    other steps.
+    '''
+
+    def __init__(self, language='english', lemmatize=True, stem=False, replace_numbers=False, tokenizer='treebank',
+                 cache=None):
+        from nltk.corpus import stopwords
+        self.language = language
+        self.tokenize = load_tokenizer(tokenizer)
+        self.stopwords = frozenset(stopwords.words(language))
+        self.number_engine = None
+        if replace_numbers:
+            import inflect
+            self.number_engine = inflect.engine()
+        self.cache = cache
+        self.lemmatize = None
+        if lemmatize:
+            from nltk.stem import WordNetLemmatizer
+            lemmatizer = WordNetLemmatizer()
+            self.lemmatize = self._cached('lemma', lambda word: lemmatizer.lemmatize(word, pos='v'))
+        self.stem = None
+        if stem:
+            from nltk.stem import LancasterStemmer
+            self.stem = self._cached('stem', LancasterStemmer().stem)
+
+    def _cached(self, namespace, function):
+        return function if self.cache is None else self.cache.memoize(namespace, function)
+
+    def clean(self, tweet):
+        """Strip URLs and the &amp; and 'br' markup left over from scraping"""
+        if not isinstance(tweet, str):
+            # missing reviews come out of pandas as NaN
+            return ''
+        tweet = url_pattern.sub('', tweet)
+        return tweet.replace('&amp;', '').replace('br', '')
+
+    def normalize_word(self, word):
+        """The normalized form of one token, or None if the token is dropped"""
+        word = unicodedata.normalize('NFKD', word).encode('ascii', 'ignore').decode('utf-8', 'ignore')
+        word = punctuation_pattern.sub('', word.lower())
+        if not word:
+            return None
+        if self.number_engine is not None and word.isdigit():
+            word = self.number_engine.number_to_words(word)
+        if self.lemmatize is not None:
+            word = self.lemmatize(word)
+        if word in self.stopwords:
+            return None
+        if self.stem is not None:
+            word = self.stem(word)
+        return word
+
+    def normalize_words(self, words):
+        normalized = []
+        for word in words:
+            word = self.normalize_word(word)
+            if word is not None:
+                normalized.append(word)
+        return normalized
+
+    def __call__(self, tweet):
+        """Return the normalized words of a raw tweet"""
+        return self.normalize_words(self.tokenize(self.clean(tweet)))
+
+    def process(self, tweet):
+        """Return the document string and the normalized words of a raw tweet"""
+        words = self(tweet)
+        return ' '.join(words), words
+
+
+PreprocessedTweets = namedtuple('PreprocessedTweets', 'documents words pos_tags cache_info')
+
+
+def pos_tag_tweets(word_lists):
+    """The part-of-speech tag of every word, tagging all the tweets in one batched call"""
+    from nltk import pos_tag_sents
+    return [tuple(tag for _, tag in tagged) for tagged in pos_tag_sents(word_lists)]
+
+
+def _normalize_chunk(normalizer, tweets, pos_tags):
+    info = normalizer.cache.cache_info()
+    results = [normalizer.process(tweet) for tweet in tweets]
+    words = [tweet_words for _, tweet_words in results]
+    tags = pos_tag_tweets(words) if pos_tags else None
+    after = normalizer.cache.cache_info()
+    # what this chunk added to the statistics of the worker's cache
+    counts = (after.hits - info.hits, after.misses - info.misses, after.evictions - info.evictions,
+              after.currsize - info.currsize)
+    return results, tags, counts
+
+
+# Normalizer of a worker process, built once by _initialize_worker
+_worker_normalizer = None
+
+
+def _initialize_worker(normalizer_options, cache_size):
+    global _worker_normalizer
+    _worker_normalizer = TweetNormalizer(cache=TokenCache(cache_size), **normalizer_options)
+
+
+def _process_chunk(tweets, pos_tags):
+    return _normalize_chunk(_worker_normalizer, tweets, pos_tags)
+
+
+class TweetPreprocessor(object):
+    '''
+    Preprocesses one batch of tweets after another with the same normalizer,
+    or the same pool of worker processes, and the same preprocessing cache.
+    Calling it on a batch returns a PreprocessedTweets holding the list of
+    documents, the list of word lists and, if pos_tags is true, the tuple of
+    part-of-speech tags of each word list, all in the order of the batch,
+    along with what the batch added to the statistics of the token caches.
+
+    With workers > 1 a batch is sent in chunks of chunk_size to that many
+    processes; workers=None uses one per CPU.  The processes are started with
+    start_method ('fork', 'spawn' or 'forkserver'), by default that of the
+    platform.  Under spawn and forkserver each of them imports the calling
+    script again, so a script that preprocesses with several workers must do
+    so under an if __name__ == '__main__': guard.  With cache_dir, tweets already
+    in the preprocessing cache there are not processed again, and the new
+    ones are added to it when the preprocessor is closed.  The remaining
+    keyword arguments go to TweetNormalizer.  Every worker has a token cache
+    of cache_size entries; the cache_info of a batch sums the statistics of
+    all of them, maxsize and currsize included.
+    '''
+
+    def __init__(self, workers=1, chunk_size=256, pos_tags=False, cache_size=2**17, cache_dir=None,
+                 start_method=None, **normalizer_options):
+        self.chunk_size = chunk_size
+        self.pos_tags = pos_tags
+        self.cache_size = cache_size
+        # one token cache in this process, or one in each worker process
+        self.how_many_caches = 1 if workers == 1 else workers or os.cpu_count() or 1
+        self.normalizer = None
+        self.executor = None
+        if workers == 1:
+            self.normalizer = TweetNormalizer(cache=TokenCache(cache_size), **normalizer_options)
+        else:
+            context = None if start_method is None else multiprocessing.get_context(start_method)
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                initializer=_initialize_worker,
+                                                initargs=(normalizer_options, cache_size))
+        self.cache = None
+        if cache_dir is not None:
+            settings = dict(normalizer_defaults, pos_tags=bool(pos_tags), **normalizer_options)
+            self.cache = PreprocessingCache(cache_dir, config_fingerprint(**settings), pos_tags=bool(pos_tags))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Write out the preprocessing cache and shut the worker processes down"""
+        if self.cache is not None:
+            self.cache.save()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __call__(self, tweets):
+        tweets = list(tweets)
+        if self.cache is None:
+            return self._process(tweets)
+        keys = [tweet_key(tweet) for tweet in tweets]
+        new_tweets = {}
+        for key, tweet in zip(keys, tweets):
+            if key not in self.cache and key not in new_tweets:
+                new_tweets[key] = tweet
+        processed = self._process(list(new_tweets.values()))
+        new_tags = processed.pos_tags if self.pos_tags else itertools.repeat(None)
+        for key, words, tags in zip(new_tweets, processed.words, new_tags):
+            self.cache.add(key, words, tags)
+        documents, words = [], []
+        tags = [] if self.pos_tags else None
+        for key in keys:
+            document, tweet_words, tweet_tags = self.cache.lookup(key)
+            documents.append(document)
+            words.append(tweet_words)
+            if self.pos_tags:
+                tags.append(tweet_tags)
+        return PreprocessedTweets(documents, words, tags, processed.cache_info)
+
+    def _process(self, tweets):
+        chunk_size = self.chunk_size
+        chunks = [tweets[start:start + chunk_size] for start in range(0, len(tweets), chunk_size)]
+        if self.executor is None:
+            processed = [_normalize_chunk(self.normalizer, chunk, self.pos_tags) for chunk in chunks]
+        else:
+            processed = self.executor.map(_process_chunk, chunks, itertools.repeat(self.pos_tags))
+        documents, words = [], []
+        tags = [] if self.pos_tags else None
+        totals = [0, 0, 0, 0]
+        for results, chunk_tags, counts in processed:
+            documents.extend(document for document, _ in results)
+            words.extend(tweet_words for _, tweet_words in results)
+            if self.pos_tags:
+                tags.extend(chunk_tags)
+            totals = [total + count for total, count in zip(totals, counts)]
+        hits, misses, evictions, currsize = totals
+        return PreprocessedTweets(documents, words, tags, CacheInfo(
+            hits, misses, evictions, self.cache_size * self.how_many_caches, currsize))
+
+
+def preprocess_tweets(tweets, **options):
+    """Preprocess all of tweets in one batch; options are those of TweetPreprocessor"""
+    with TweetPreprocessor(**options) as preprocessor:
+        return preprocessor(tweets)
+
+
+def preprocess_tweet_chunks(tweet_chunks, **options):
+    """
+    Generator of the PreprocessedTweets of each batch in tweet_chunks, for
+    streams too large to hold in memory; options are those of
+    TweetPreprocessor.
+    """
+    with TweetPreprocessor(**options) as preprocessor:
+        for tweets in tweet_chunks:
+            yield preprocessor(tweets)
+
+
+# The original preprocessing chain of lsHash.py, one list-building pass per step
+
+def remove_non_ascii(words):
+    """Remove non-ASCII characters from list of tokenized words"""
+    new_words = []
+    for word in words:
+        new_word = unicodedata.normalize('NFKD', word).encode(
+            'ascii', 'ignore').decode('utf-8', 'ignore')
+        new_words.append(new_word)
+    return new_words
+
+
+def to_lowercase(words):
+    """Convert all characters to lowercase from list of tokenized words"""
+    new_words = []
+    for word in words:
+        new_word = word.lower()
+        new_words.append(new_word)
+    return new_words
+
+
+def remove_punctuation(words):
+    """Remove punctuation from list of tokenized words"""
+    new_words = []
+    for word in words:
+        new_word = re.sub(r'[^\w\s]', '', word)
+        if new_word != '':
+            new_words.append(new_word)
+    return new_words
+
+
+def replace_numbers(words):
+    """Replace all interger occurrences in list of tokenized words with textual representation"""
+    import inflect
+    p = inflect.engine()
+    new_words = []
+    for word in words:
+        if word.isdigit():
+            new_word = p.number_to_words(word)
+            new_words.append(new_word)
+        else:
+            new_words.append(word)
+    return new_words
+
+
+def remove_stopwords(words):
+    """Remove stop words from list of tokenized words"""
+    from nltk.corpus import stopwords
+    new_words = []
+    for word in words:
+        if word not in stopwords.words('english'):
+            new_words.append(word)
+    return new_words
+
+
+def stem_words(words):
+    """Stem words in list of tokenized words"""
+    from nltk.stem import LancasterStemmer
+    stemmer = LancasterStemmer()
+    stems = []
+    for word in words:
+        stem = stemmer.stem(word)
+        stems.append(stem)
+    return stems
+
+
+def lemmatize_verbs(words):
+    """Lemmatize verbs in list of tokenized words"""
+    from nltk.stem import WordNetLemmatizer
+    lemmatizer = WordNetLemmatizer()
+    lemmas = []
+    for word in words:
+        lemma = lemmatizer.lemmatize(word, pos='v')
+        lemmas.append(lemma)
+    return lemmas
+
+
+def normalize(words):
+    words = remove_non_ascii(words)
+    words = to_lowercase(words)
+    words = remove_punctuation(words)
+    # words = replace_numbers(words)
+    words = lemmatize_verbs(words)
+    words = remove_stopwords(words)
+    return words
+
+
+def legacy_preprocess(tweet):
+    """The per-tweet steps of the original lsHash.py loop"""
+    from nltk.tokenize import word_tokenize
+    tweet = re.sub(url_pattern.pattern, '', tweet)
+    tweet = re.sub("&amp;", "", tweet)
+    tweet = re.sub("br", "", tweet)
+    words = word_tokenize(tweet)
+    return normalize(words)
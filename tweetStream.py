@@ -0,0 +1,106 @@
+'''
+Streaming ingestion of a tweet CSV file.
+
+read_tweet_chunks() reads the tweets in bounded chunks instead of loading
+the whole file, tweetPreprocessing.preprocess_tweet_chunks() normalizes
+each chunk, and stream_minhash_signatures() MinHashes the documents of each
+chunk as it arrives.  The MinHash of a document depends only on the strings
+of its shingles, so each chunk is shingled against a vocabulary of its own
+and no corpus-wide vocabulary is ever built; the signatures are the same as
+those of the whole corpus vectorized at once.  Only one chunk of raw tweets
+and shingles is in memory at a time.
+
+ngram_shingles() tokenizes each document once and cuts the tokens into
+n-grams of several sizes, so that unigram, bigram and trigram runs share
+one tokenization pass instead of re-vectorizing the corpus for each size.
+'''
+import re
+
+import numpy
+from scipy.sparse import csr_matrix
+
+from batchMinHash import feature_hashes, minhash_signatures
+
+# The default token_pattern of scikit-learn's text vectorizers
+word_pattern = re.compile(r"(?u)\b\w\w+\b")
+
+
+def read_tweet_chunks(filename, column='review', chunk_size=10000, limit=None):
+    """
+    Generator of lists of at most chunk_size tweets from the column of a CSV
+    file, stopping after limit tweets if limit is given.  Missing tweets come
+    through as NaN, which the normalizer treats as empty.
+    """
+    import pandas as pd
+    remaining = limit
+    for frame in pd.read_csv(filename, usecols=[column], chunksize=chunk_size):
+        tweets = frame[column].tolist()
+        if remaining is not None:
+            tweets = tweets[:remaining]
+            remaining -= len(tweets)
+        if tweets:
+            yield tweets
+        if remaining is not None and remaining <= 0:
+            return
+
+
+def ngram_shingles(documents, ngram_sizes, tokenizer=None):
+    """
+    Return {n: the list of word n-grams of every document} for every n in
+    ngram_sizes, tokenizing each document only once.  The n-grams are those
+    of TfidfVectorizer(ngram_range=(n, n)): the lowercased documents are split
+    with tokenizer, which defaults to TfidfVectorizer's token pattern, and
+    the words of an n-gram are joined with single spaces.
+    """
+    if tokenizer is None:
+        tokenizer = word_pattern.findall
+    shingles = dict((n, []) for n in ngram_sizes)
+    for document in documents:
+        tokens = tokenizer(document.lower())
+        for n in ngram_sizes:
+            if n == 1:
+                shingles[n].append(tokens)
+            else:
+                shingles[n].append([' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)])
+    return shingles
+
+
+def shingle_matrix(documents, analyzer=None):
+    """
+    Return a CSR matrix with a 1 for every shingle of every document, as
+    produced by analyzer (e.g. the build_analyzer() of a scikit-learn
+    vectorizer), together with the 32-bit hash of the shingle of each column.
+    Without an analyzer the documents are taken to be lists of shingles
+    already.  The columns are local to this batch of documents.
+    """
+    vocabulary = {}
+    indices = []
+    indptr = [0]
+    for document in documents:
+        for shingle in set(document if analyzer is None else analyzer(document)):
+            indices.append(vocabulary.setdefault(shingle, len(vocabulary)))
+        indptr.append(len(indices))
+    X = csr_matrix((numpy.ones(len(indices), dtype=numpy.uint8), indices, indptr),
+                   shape=(len(documents), len(vocabulary)))
+    return X, feature_hashes(vocabulary)
+
+
+def stream_minhash_signatures(document_chunks, analyzer, num_perm=128, seed=1):
+    """Generator of the MinHash signature block of each chunk of documents"""
+    for documents in document_chunks:
+        X, hashes = shingle_matrix(documents, analyzer)
+        yield minhash_signatures(X, num_perm=num_perm, seed=seed, hashes=hashes)
+
+
+def stream_ngram_minhash_signatures(document_chunks, ngram_sizes, num_perm=128, seed=1):
+    """
+    Generator of {n: MinHash signature block} for each chunk of documents,
+    with the n-gram shingles of every size taken from one tokenization
+    """
+    for documents in document_chunks:
+        shingles = ngram_shingles(documents, ngram_sizes)
+        blocks = {}
+        for n in ngram_sizes:
+            X, hashes = shingle_matrix(shingles[n])
+            blocks[n] = minhash_signatures(X, num_perm=num_perm, seed=seed, hashes=hashes)
+        yield blocks